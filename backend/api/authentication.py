@@ -0,0 +1,91 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from foodgram.db import use_primary
+
+TOKEN_KEY = 'auth:token:{}'
+USER_KEY = 'auth:user:{}'
+# Поля пользователя, которые хранятся в кеше. Хеш пароля туда не попадает:
+# кеш может быть общим (Redis, memcached), а остальные поля подгружаются из
+# базы при первом обращении, как отложенные поля only().
+USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name',
+               'is_active', 'is_staff', 'is_superuser', 'last_login',
+               'date_joined')
+
+
+def get_token_key(key):
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def get_cached_user(user_id):
+    if user_id is None:
+        return None
+    values = cache.get(USER_KEY.format(user_id))
+    if values is None:
+        return None
+    model = get_user_model()
+    fields = [field.attname for field in model._meta.concrete_fields
+              if field.attname in values]
+    user = model.from_db(DEFAULT_DB_ALIAS, fields,
+                         [values[field] for field in fields])
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+    return user
+
+
+def cache_user(user):
+    cache.set(
+        USER_KEY.format(user.pk),
+        {field: getattr(user, field) for field in USER_FIELDS},
+        settings.AUTH_CACHE_TIMEOUT
+    )
+
+
+def invalidate_token(key):
+    transaction.on_commit(lambda: cache.delete(get_token_key(key)))
+
+
+def invalidate_user(user_id):
+    transaction.on_commit(lambda: cache.delete(USER_KEY.format(user_id)))
+
+
+# Стандартная TokenAuthentication делает запрос Token + User на каждый
+# запрос к API. Здесь связка «токен -> id пользователя» и сам пользователь
+# кешируются раздельно: изменение пользователя (пароль, деактивация) сбрасывает
+# одну запись по id, не зная его токенов, а выход — запись токена. Промах кеша
+# читается с основной базы: только что выданного токена на реплике может ещё
+# не быть. Сброс записей виден всем процессам, только если кеш общий: с
+# LocMemCache по умолчанию выход и деактивация действуют в остальных
+# воркерах лишь через AUTH_CACHE_TIMEOUT.
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        token_key = get_token_key(key)
+        user = get_cached_user(cache.get(token_key))
+        if user is not None:
+            return user, self.get_model()(key=key, user=user)
+        with use_primary():
+            user, token = super().authenticate_credentials(key)
+        cache.set(token_key, user.pk, settings.AUTH_CACHE_TIMEOUT)
+        cache_user(user)
+        return user, token
+
+
+# JWT проверяется без обращения к базе, а пользователь берётся из того же
+# кеша, что и для токенов.
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user = get_cached_user(validated_token.get(jwt_settings.USER_ID_CLAIM))
+        if user is None:
+            with use_primary():
+                user = super().get_user(validated_token)
+            cache_user(user)
+        return user
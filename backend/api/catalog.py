@@ -0,0 +1,69 @@
+import hashlib
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from foodgram.db import use_primary
+
+CATALOG_VERSION_KEY = 'catalog:{}:version'
+CATALOG_DATA_KEY = 'catalog:{}:data:{}'
+
+
+def new_catalog_version():
+    return uuid4().hex, int(time.time())
+
+
+# Версия меняется после фиксации: иначе запрос, прочитавший строки до неё,
+# сохранил бы их под новой версией на CATALOG_CACHE_TIMEOUT.
+def bump_catalog_version(catalog):
+    transaction.on_commit(lambda: cache.set(
+        CATALOG_VERSION_KEY.format(catalog), new_catalog_version(), None
+    ))
+
+
+def get_catalog_version(catalog):
+    key = CATALOG_VERSION_KEY.format(catalog)
+    version = cache.get(key)
+    if version is None:
+        version = new_catalog_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key)
+    return version
+
+
+class CatalogCacheMixin:
+    catalog = None
+
+    def get_catalog_data(self, request, token):
+        key = CATALOG_DATA_KEY.format(self.catalog, token)
+        data = cache.get(key)
+        if data is None:
+            with use_primary():
+                data = list(self.get_serializer(
+                    self.filter_queryset(self.get_queryset()), many=True
+                ).data)
+            cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return data
+
+    def list(self, request, *args, **kwargs):
+        token, modified = get_catalog_version(self.catalog)
+        etag = quote_etag(hashlib.md5(
+            f'{token}:{request.get_full_path()}'.encode()
+        ).hexdigest())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=modified
+        )
+        if response is None:
+            response = Response(self.get_catalog_data(request, token))
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        patch_cache_control(
+            response, public=True, max_age=settings.CATALOG_MAX_AGE
+        )
+        return response
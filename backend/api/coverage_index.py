@@ -0,0 +1,242 @@
+import threading
+import time
+from array import array
+from collections import defaultdict
+from uuid import uuid4
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+from foodgram.db import use_primary
+from recipes.models import RecipeIngredient
+
+EPOCH_KEY = 'coverage:epoch'
+SEQUENCE_KEY = 'coverage:sequence'
+CHANGE_KEY = 'coverage:change:{}'
+CHANGE_TIMEOUT = 60 * 60 * 24
+# При большем отставании от журнала изменений индекс строится заново.
+MAX_PENDING = 5000
+# Столько секунд ждём запись журнала, номер которой уже выдан: потом
+# считаем её потерянной (истекла или вытеснена из кеша) и строим индекс
+# заново.
+GAP_TIMEOUT = 10
+BUILD_CHUNK_SIZE = 10000
+
+
+def reset_coverage_index():
+    transaction.on_commit(lambda: cache.set(EPOCH_KEY, uuid4().hex, None))
+
+
+def mark_recipes_changed(recipe_ids):
+    recipe_ids = list(recipe_ids)
+
+    def publish():
+        cache.add(SEQUENCE_KEY, 0, None)
+        for recipe_id in recipe_ids:
+            cache.set(CHANGE_KEY.format(cache.incr(SEQUENCE_KEY)), recipe_id,
+                      CHANGE_TIMEOUT)
+
+    if recipe_ids:
+        transaction.on_commit(publish)
+
+
+def get_epoch():
+    epoch = cache.get(EPOCH_KEY)
+    if epoch is None:
+        epoch = uuid4().hex
+        if not cache.add(EPOCH_KEY, epoch, None):
+            epoch = cache.get(EPOCH_KEY)
+    return epoch
+
+
+# Инвертированный индекс «ингредиент -> отсортированный массив id рецептов»,
+# прямой «рецепт -> id ингредиентов» для точечных обновлений
+# и число ингредиентов каждого рецепта (массив, индексированный id) на NumPy:
+# покрытие считается одним bincount по спискам ингредиентов из холодильника.
+# Прямой индекс хранится в формате CSR: ингредиенты рецепта r лежат в
+# _ingredient_ids[_offsets[r]:_offsets[r + 1]], а рецепты, изменённые после
+# сборки, берутся из словаря _overrides.
+# Индекс живёт в памяти процесса; изменения рецептов публикуются в кеш как
+# журнал с последовательными номерами, и каждый процесс догоняет его точечно.
+class CoverageIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._epoch = None
+        self._sequence = 0
+        self._gap = None
+        self._postings = {}
+        self._offsets = np.zeros(1, dtype=np.uint32)
+        self._ingredient_ids = np.zeros(0, dtype=np.uint32)
+        self._overrides = {}
+        self._totals = np.zeros(1, dtype=np.uint16)
+
+    @staticmethod
+    def _build():
+        recipe_ids = array('I')
+        ingredient_ids = array('I')
+        rows = RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).order_by().iterator(chunk_size=BUILD_CHUNK_SIZE)
+        for recipe_id, ingredient_id in rows:
+            recipe_ids.append(recipe_id)
+            ingredient_ids.append(ingredient_id)
+        recipe_ids = np.frombuffer(recipe_ids, dtype=np.uint32)
+        ingredient_ids = np.frombuffer(ingredient_ids, dtype=np.uint32)
+        order = np.lexsort((recipe_ids, ingredient_ids))
+        unique, starts = np.unique(ingredient_ids[order], return_index=True)
+        postings = {
+            int(ingredient_id): recipes for ingredient_id, recipes in zip(
+                unique, np.split(recipe_ids[order], starts[1:])
+            )
+        }
+        counts = np.bincount(recipe_ids)
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.uint32)
+        order = np.lexsort((ingredient_ids, recipe_ids))
+        return (postings, offsets, ingredient_ids[order],
+                counts.astype(np.uint16))
+
+    def _recipe_ingredients(self, recipe_id):
+        if recipe_id in self._overrides:
+            return self._overrides[recipe_id]
+        if recipe_id + 1 < len(self._offsets):
+            return self._ingredient_ids[
+                self._offsets[recipe_id]:self._offsets[recipe_id + 1]
+            ]
+        return ()
+
+    def _apply(self, recipe_ids):
+        ingredients = defaultdict(set)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].add(ingredient_id)
+        postings = self._postings
+        for recipe_id in recipe_ids:
+            # Меняются только списки ингредиентов, которые рецепт потерял
+            # или приобрёл, а не все списки индекса.
+            old = set(map(int, self._recipe_ingredients(recipe_id)))
+            new = ingredients[recipe_id]
+            for ingredient_id in old - new:
+                recipes = postings[ingredient_id]
+                recipes = np.delete(
+                    recipes, np.searchsorted(recipes, recipe_id)
+                )
+                if len(recipes):
+                    postings[ingredient_id] = recipes
+                else:
+                    del postings[ingredient_id]
+            for ingredient_id in new - old:
+                recipes = postings.get(
+                    ingredient_id, np.zeros(0, dtype=np.uint32)
+                )
+                postings[ingredient_id] = np.insert(
+                    recipes, np.searchsorted(recipes, recipe_id), recipe_id
+                )
+            self._overrides[recipe_id] = np.array(sorted(new),
+                                                  dtype=np.uint32)
+            if recipe_id >= len(self._totals):
+                self._totals = np.concatenate((self._totals, np.zeros(
+                    recipe_id + 1 - len(self._totals), dtype=np.uint16
+                )))
+            self._totals[recipe_id] = len(ingredients[recipe_id])
+
+    def _catch_up(self, sequence):
+        numbers = range(self._sequence + 1, sequence + 1)
+        keys = [CHANGE_KEY.format(number) for number in numbers]
+        changes = cache.get_many(keys)
+        recipe_ids = set()
+        for number, key in zip(numbers, keys):
+            # Номер уже выдан, но запись ещё не появилась: дочитаем позже.
+            if key not in changes:
+                break
+            recipe_ids.add(changes[key])
+            self._sequence = number
+        self._apply(recipe_ids)
+        if self._sequence == sequence:
+            self._gap = None
+            return True
+        now = time.monotonic()
+        if self._gap is None or self._gap[0] != self._sequence + 1:
+            self._gap = (self._sequence + 1, now)
+        return now - self._gap[1] < GAP_TIMEOUT
+
+    def _refresh(self):
+        epoch = get_epoch()
+        sequence = cache.get(SEQUENCE_KEY, 0)
+        if epoch == self._epoch and sequence == self._sequence:
+            return
+        # Индекс живёт дольше запроса, поэтому читается с основной базы:
+        # отставшая реплика оставила бы в нём устаревшие данные.
+        with use_primary():
+            with self._lock:
+                if epoch == self._epoch and sequence == self._sequence:
+                    return
+                if (epoch == self._epoch and sequence > self._sequence
+                        and sequence - self._sequence <= MAX_PENDING
+                        and len(self._overrides) <= MAX_PENDING
+                        and self._catch_up(sequence)):
+                    return
+            self._rebuild(epoch, sequence)
+
+    # Сборка идёт без основной блокировки: поиск в это время отвечает по
+    # прежнему индексу и ждёт только подмены готовых массивов. Пока индекса
+    # ещё нет, запросы ждут первую сборку.
+    def _rebuild(self, epoch, sequence):
+        if not self._build_lock.acquire(blocking=self._epoch is None):
+            return
+        try:
+            if self._epoch == epoch and self._sequence >= sequence:
+                return
+            postings, offsets, ingredient_ids, totals = self._build()
+            with self._lock:
+                self._postings = postings
+                self._offsets = offsets
+                self._ingredient_ids = ingredient_ids
+                self._overrides = {}
+                self._totals = totals
+                self._epoch = epoch
+                self._sequence = sequence
+                self._gap = None
+        finally:
+            self._build_lock.release()
+
+    def search(self, ingredient_ids, max_missing, limit):
+        self._refresh()
+        with self._lock:
+            postings = [
+                self._postings[ingredient_id]
+                for ingredient_id in set(ingredient_ids)
+                if ingredient_id in self._postings
+            ]
+            totals = self._totals
+        if not postings:
+            return []
+        matched = np.bincount(np.concatenate(postings),
+                              minlength=len(totals))[:len(totals)]
+        candidates = np.flatnonzero(matched)
+        matched = matched[candidates]
+        missing = totals[candidates].astype(np.int64) - matched
+        if max_missing is not None:
+            keep = missing <= max_missing
+            candidates, matched, missing = (
+                candidates[keep], matched[keep], missing[keep]
+            )
+        # Сначала меньше недостающих, затем больше совпавших, затем новее.
+        # В argpartition ключи упакованы в одно число, id < 2 ** 32.
+        key = ((missing << 48) | ((0xFFFF - matched) << 32)
+               | (0xFFFFFFFF - candidates))
+        if len(key) > limit:
+            top = np.argpartition(key, limit)[:limit]
+        else:
+            top = np.arange(len(key))
+        top = top[np.argsort(key[top])]
+        return [
+            (int(candidates[position]), int(matched[position]),
+             int(missing[position]))
+            for position in top
+        ]
+
+
+coverage_index = CoverageIndex()
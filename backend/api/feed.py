@@ -0,0 +1,132 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+
+from recipes.models import FeedEntry, Recipe
+from users.models import Follow
+
+FAN_IN_KEY = 'feed:fan_in'
+FAN_IN_LOCK_KEY = 'feed:fan_in:lock'
+
+FEED_ENTRIES = '''
+    INSERT INTO recipes_feedentry (user_id, recipe_id, author_id)
+    SELECT follow.user_id, recipe.id, recipe.author_id
+    FROM recipes_recipe recipe
+    JOIN users_follow follow ON follow.author_id = recipe.author_id
+    WHERE {condition}
+    ON CONFLICT (user_id, recipe_id) DO NOTHING
+'''
+# Последние FEED_BACKFILL_LIMIT рецептов автора.
+LATEST_RECIPES = '''
+    recipe.id IN (
+        SELECT latest.id FROM recipes_recipe latest
+        WHERE latest.author_id = recipe.author_id
+        ORDER BY latest.id DESC LIMIT %s
+    )
+'''
+
+
+def write_entries(condition, params, fan_in=None):
+    if fan_in is None:
+        fan_in = get_fan_in_authors()
+    if fan_in:
+        condition += ' AND recipe.author_id NOT IN ({})'.format(
+            ', '.join(['%s'] * len(fan_in))
+        )
+        params = [*params, *fan_in]
+    with connection.cursor() as cursor:
+        cursor.execute(FEED_ENTRIES.format(condition=condition), params)
+
+
+def count_fan_in_authors():
+    return set(Follow.objects.order_by().values('author_id').annotate(
+        followers=Count('id')
+    ).filter(
+        followers__gte=settings.FEED_FAN_IN_FOLLOWERS
+    ).values_list('author_id', flat=True))
+
+
+# Авторы, у которых подписчиков не меньше FEED_FAN_IN_FOLLOWERS. Их рецепты
+# не раскладываются по лентам при публикации, а читаются из recipes_recipe.
+# Множество пересчитывается раз в FEED_FAN_IN_TIMEOUT секунд одним процессом;
+# автору, выпавшему из него, ленты подписчиков дозаполняются, иначе рецепты,
+# опубликованные без раскладки, из них пропали бы.
+def get_fan_in_authors(refresh=False):
+    state = cache.get(FAN_IN_KEY)
+    locked = False
+    if state is not None and not refresh:
+        if state['expires'] > time.time():
+            return state['authors']
+        locked = cache.add(FAN_IN_LOCK_KEY, 1, 60)
+        if not locked:
+            return state['authors']
+    try:
+        authors = count_fan_in_authors()
+        demoted = state['authors'] - authors if state is not None else ()
+        if demoted:
+            write_entries(
+                'recipe.author_id IN ({}) AND {}'.format(
+                    ', '.join(['%s'] * len(demoted)), LATEST_RECIPES
+                ),
+                [*demoted, settings.FEED_BACKFILL_LIMIT], authors
+            )
+        cache.set(FAN_IN_KEY, {
+            'authors': authors,
+            'expires': time.time() + settings.FEED_FAN_IN_TIMEOUT,
+        }, None)
+    finally:
+        # Блокировку снимает только тот, кто её взял: при холодном кеше и
+        # при refresh она не берётся и может принадлежать другому процессу.
+        if locked:
+            cache.delete(FAN_IN_LOCK_KEY)
+    return authors
+
+
+def fan_out_recipe(recipe):
+    write_entries('recipe.id = %s', [recipe.pk])
+
+
+def backfill_feed(follow):
+    write_entries(
+        f'follow.id = %s AND {LATEST_RECIPES}',
+        [follow.pk, settings.FEED_BACKFILL_LIMIT]
+    )
+
+
+def clear_feed(follow):
+    FeedEntry.objects.filter(
+        user_id=follow.user_id, author_id=follow.author_id
+    ).delete()
+
+
+def rebuild_feeds(min_recipe_id=None):
+    fan_in = get_fan_in_authors(refresh=True)
+    if min_recipe_id is None:
+        write_entries(LATEST_RECIPES, [settings.FEED_BACKFILL_LIMIT], fan_in)
+    else:
+        write_entries('recipe.id >= %s', [min_recipe_id], fan_in)
+
+
+def get_feed(user_id, before, limit):
+    entries = FeedEntry.objects.filter(user_id=user_id)
+    if before is not None:
+        entries = entries.filter(recipe_id__lt=before)
+    recipe_ids = list(entries.order_by('-recipe_id').values_list(
+        'recipe_id', flat=True
+    )[:limit])
+    fan_in = get_fan_in_authors()
+    authors = list(Follow.objects.filter(
+        user_id=user_id, author_id__in=fan_in
+    ).values_list('author_id', flat=True)) if fan_in else []
+    if not authors:
+        return recipe_ids
+    recipes = Recipe.objects.filter(author_id__in=authors)
+    if before is not None:
+        recipes = recipes.filter(id__lt=before)
+    recipe_ids.extend(recipes.order_by('-id').values_list(
+        'id', flat=True
+    )[:limit])
+    return sorted(set(recipe_ids), reverse=True)[:limit]
@@ -1,15 +1,8 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Ingredient, Recipe, Tag
-
-
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 
 
 class RecipeFilter(FilterSet):
@@ -17,7 +10,17 @@ class RecipeFilter(FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
+    tags_match = filters.ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='filter_tags_match',
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering',
+    )
+    search = filters.CharFilter(method='filter_search')
     is_favorited = filters.NumberFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.NumberFilter(
         method='filter_is_in_shopping_cart'
@@ -25,7 +28,37 @@ class RecipeFilter(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',)
+        fields = ('tags', 'tags_match', 'author', 'is_favorited',
+                  'is_in_shopping_cart', 'ordering', 'search',)
+
+    @staticmethod
+    def recipe_has_tags(tags):
+        return Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=tags
+        ))
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        if self.form.cleaned_data.get('tags_match') == 'all':
+            for tag in value:
+                queryset = queryset.filter(self.recipe_has_tags([tag]))
+            return queryset
+        return queryset.filter(self.recipe_has_tags(value))
+
+    def filter_tags_match(self, queryset, name, value):
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        if value == 'popular':
+            return queryset.order_by('-favorites_count', '-id')
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        queryset = search_recipes(queryset, value)
+        if self.form.cleaned_data.get('ordering'):
+            return queryset
+        return queryset.order_by('-search_rank', '-id')
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
@@ -35,4 +68,4 @@ class RecipeFilter(FilterSet):
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(cart__user=self.request.user)
-        return
+        return queryset
@@ -0,0 +1,58 @@
+import threading
+from bisect import bisect_left
+
+from foodgram.db import use_primary
+from recipes.models import Ingredient
+
+from .catalog import get_catalog_version
+
+
+class IngredientIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        # Имена и строки заменяются одним присваиванием, чтобы поиск без
+        # блокировки не увидел имена одной сборки со строками другой.
+        self._data = ([], [])
+
+    def _build(self):
+        ingredients = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda ingredient: (ingredient['name'].casefold(),
+                                    ingredient['id'])
+        )
+        return (
+            [ingredient['name'].casefold() for ingredient in ingredients],
+            ingredients,
+        )
+
+    def _refresh(self):
+        version = get_catalog_version('ingredients')
+        if version == self._version:
+            return
+        with self._lock, use_primary():
+            if version != self._version:
+                self._data = self._build()
+                self._version = version
+
+    def search(self, query, limit):
+        self._refresh()
+        names, ingredients = self._data
+        query = query.casefold()
+        if not query:
+            return ingredients[:limit]
+        found = []
+        position = bisect_left(names, query)
+        while (position < len(names) and len(found) < limit
+               and names[position].startswith(query)):
+            found.append(ingredients[position])
+            position += 1
+        for name, ingredient in zip(names, ingredients):
+            if len(found) >= limit:
+                break
+            if query in name and not name.startswith(query):
+                found.append(ingredient)
+        return found
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .recipe_cache import get_metrics as get_recipe_cache_metrics
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+NUMBER = re.compile(r'\b\d+\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+
+METRICS = (
+    ('requests_total', 'counter', 'Количество запросов'),
+    ('db_queries_total', 'counter', 'Количество SQL-запросов'),
+    ('db_seconds_total', 'counter', 'Время выполнения SQL'),
+    ('app_seconds_total', 'counter', 'Время Python-кода и сериализации'),
+    ('render_seconds_total', 'counter', 'Время рендеринга ответа'),
+    ('duration_seconds_total', 'counter', 'Полное время обработки'),
+    ('response_bytes_total', 'counter', 'Размер ответов'),
+    ('over_budget_total', 'counter', 'Запросы сверх бюджета'),
+)
+
+
+def fingerprint(sql):
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    return IN_LIST.sub('(...)', sql)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(Counter)
+
+    def record(self, labels, **values):
+        with self._lock:
+            self._values[labels].update(values)
+
+    def render(self):
+        with self._lock:
+            values = {
+                labels: dict(counter)
+                for labels, counter in self._values.items()
+            }
+        lines = []
+        for name, kind, description in METRICS:
+            lines.append(f'# HELP foodgram_{name} {description}')
+            lines.append(f'# TYPE foodgram_{name} {kind}')
+            for (view, method), counter in sorted(values.items()):
+                lines.append(
+                    f'foodgram_{name}{{view="{view}",method="{method}"}} '
+                    f'{counter.get(name, 0)}'
+                )
+        for event, total in get_recipe_cache_metrics().items():
+            lines.append(
+                f'foodgram_recipe_cache_total{{result="{event}"}} {total}'
+            )
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+# Счётчик запросов текущего HTTP-запроса. Соединения с базой принадлежат
+# потокам, а под ASGI запрос выполняется в потоке синхронных представлений
+# или в пуле api.async_views, поэтому обёртка ставится на каждое соединение
+# при его открытии (сигнал connection_created) и находит счётчик через
+# ContextVar, который asgiref переносит в эти потоки.
+_recorder = ContextVar('query_recorder', default=None)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_execute_wrapper(connection):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+@contextmanager
+def record_queries(recorder):
+    token = _recorder.set(recorder)
+    try:
+        yield
+    finally:
+        _recorder.reset(token)
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder = self.start(request)
+        with record_queries(recorder):
+            response = self.get_response(request)
+        return self.finish(request, recorder, response)
+
+    async def __acall__(self, request):
+        recorder = self.start(request)
+        with record_queries(recorder):
+            response = await self.get_response(request)
+        return self.finish(request, recorder, response)
+
+    def start(self, request):
+        request._view_finished = None
+        request._started = time.perf_counter()
+        return QueryRecorder()
+
+    def finish(self, request, recorder, response):
+        finished = time.perf_counter()
+        view_finished = request._view_finished or finished
+        duration = finished - request._started
+        render = finished - view_finished
+        app = max(duration - recorder.duration - render, 0)
+        size = 0 if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={recorder.duration * 1000:.1f};'
+            f'desc="{recorder.count} queries"',
+            f'app;dur={app * 1000:.1f}',
+            f'render;dur={render * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+        over_budget = (
+            recorder.count > settings.REQUEST_QUERY_BUDGET
+            or duration * 1000 > settings.REQUEST_TIME_BUDGET_MS
+        )
+        match = request.resolver_match
+        registry.record(
+            (match.view_name if match else 'unresolved', request.method),
+            requests_total=1,
+            db_queries_total=recorder.count,
+            db_seconds_total=recorder.duration,
+            app_seconds_total=app,
+            render_seconds_total=render,
+            duration_seconds_total=duration,
+            response_bytes_total=size,
+            over_budget_total=int(over_budget),
+        )
+        if over_budget:
+            logger.warning(
+                '%s %s: %d queries, %.1f ms (db %.1f ms), top SQL: %s',
+                request.method, request.path, recorder.count,
+                duration * 1000, recorder.duration * 1000,
+                recorder.fingerprints.most_common(5)
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        request._view_finished = time.perf_counter()
+        return response
+
+
+def metrics(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
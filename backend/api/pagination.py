@@ -0,0 +1,44 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+
+
+class PageLimitPagination(PageNumberPagination):
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class RecipeCursorPagination(CursorPagination):
+    ordering = '-id'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+# Лента собирается из нескольких источников, поэтому курсор хранит только id
+# последнего рецепта страницы, а страница запрашивается функцией
+# fetch(before, limit), возвращающей id рецептов по убыванию.
+class FeedCursorPagination(RecipeCursorPagination):
+    def paginate_feed(self, fetch, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        try:
+            before = int(cursor.position) if cursor else None
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        recipe_ids = fetch(before, self.page_size + 1)
+        self.has_next = len(recipe_ids) > self.page_size
+        self.page = recipe_ids[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False, position=str(self.page[-1])
+        ))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
@@ -0,0 +1,182 @@
+import hashlib
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+GENERATION_KEY = 'recipes:generation'
+VERSION_KEY = 'recipes:version:{}'
+RESPONSE_KEY = 'recipes:response:{}:{}'
+METRICS_KEY = 'recipes:metrics:{}'
+PERSONAL_KEY = 'recipes:personal:{}'
+PERSONAL_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+# Результаты поиска зависят от текста рецептов, а не только от состава
+# выборки, и почти не повторяются, поэтому общий кеш их не хранит.
+UNCACHED_FILTERS = ('search',)
+
+
+def get_cache():
+    return caches[settings.RECIPE_CACHE_ALIAS]
+
+
+def bump_generation():
+    transaction.on_commit(
+        lambda: get_cache().set(GENERATION_KEY, uuid4().hex, None)
+    )
+
+
+def bump_recipe_versions(recipe_ids):
+    versions = {
+        VERSION_KEY.format(recipe_id): uuid4().hex
+        for recipe_id in recipe_ids
+    }
+    if versions:
+        transaction.on_commit(lambda: get_cache().set_many(versions, None))
+
+
+def get_generation():
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid4().hex
+        if not cache.add(GENERATION_KEY, generation, None):
+            generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def get_recipe_versions(recipe_ids):
+    cache = get_cache()
+    keys = [VERSION_KEY.format(recipe_id) for recipe_id in recipe_ids]
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def count(event):
+    cache = get_cache()
+    key = METRICS_KEY.format(event)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_metrics():
+    cache = get_cache()
+    return {
+        event: cache.get(METRICS_KEY.format(event), 0)
+        for event in ('hit', 'miss')
+    }
+
+
+def normalize_query(request):
+    params = request.query_params
+    return urlencode(sorted(
+        (key, value) for key in params for value in params.getlist(key)
+    ))
+
+
+def get_personal_sets(user):
+    cache = get_cache()
+    key = PERSONAL_KEY.format(user.pk)
+    personal = cache.get(key)
+    if personal is None:
+        personal = (
+            set(user.favorites.values_list('recipe_id', flat=True)),
+            set(user.cart.values_list('recipe_id', flat=True)),
+            set(user.follower.values_list('author_id', flat=True)),
+        )
+        cache.set(key, personal, settings.RECIPE_CACHE_TIMEOUT)
+    return personal
+
+
+def invalidate_personal_sets(user_id):
+    transaction.on_commit(
+        lambda: get_cache().delete(PERSONAL_KEY.format(user_id))
+    )
+
+
+def overlay_personal_data(data, user):
+    favorites, cart, following = get_personal_sets(user)
+    for recipe in data.get('results', [data]):
+        recipe['is_favorited'] = recipe['id'] in favorites
+        recipe['is_in_shopping_cart'] = recipe['id'] in cart
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in following
+        )
+
+
+def is_personal_query(request):
+    return any(
+        request.query_params.get(name, '0') not in ('', '0')
+        for name in PERSONAL_FILTERS
+    )
+
+
+def is_uncached_query(request):
+    return any(request.query_params.get(name) for name in UNCACHED_FILTERS)
+
+
+# Общая для всех пользователей страница рецептов кешируется, а признаки
+# избранного, списка покупок и подписки накладываются поверх неё из множеств
+# id, которые загружаются одним запросом каждое и кешируются по пользователю.
+#
+# Запись хранит версии попавших в ответ рецептов и устаревает, как только
+# изменилась версия любого из них. Поколение в ключе меняется, когда может
+# измениться состав выборки: рецепт создан или удалён, изменились его теги.
+class RecipeCacheMixin:
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        user = request.user
+        if (user.is_authenticated and is_personal_query(request)
+                or is_uncached_query(request)):
+            response = handler(request, *args, **kwargs)
+        else:
+            response = self.shared_response(handler, request, *args, **kwargs)
+        if (user.is_authenticated
+                and response.status_code == status.HTTP_200_OK):
+            overlay_personal_data(response.data, user)
+        return response
+
+    def shared_response(self, handler, request, *args, **kwargs):
+        cache = get_cache()
+        # Ссылки next/previous и изображений в ответе абсолютные, поэтому
+        # схема и хост входят в ключ наравне с путём.
+        key = RESPONSE_KEY.format(get_generation(), hashlib.md5(
+            f'{request.scheme}://{request.get_host()}{request.path}'
+            f'?{normalize_query(request)}'.encode()
+        ).hexdigest())
+        entry = cache.get(key)
+        if entry is not None:
+            versions = cache.get_many(entry['versions'])
+            if versions == entry['versions']:
+                count('hit')
+                return Response(entry['data'], headers={'X-Cache': 'HIT'})
+        count('miss')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            data = response.data
+            recipes = data.get('results', [data])
+            cache.set(key, {
+                'data': data,
+                'versions': get_recipe_versions(
+                    recipe['id'] for recipe in recipes
+                ),
+            }, settings.RECIPE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -1,6 +1,10 @@
-import base64
+import binascii
+import logging
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.utils.crypto import get_random_string
 from djoser.serializers import UserCreateSerializer, UserSerializer
@@ -8,8 +12,14 @@ from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 
 from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.search import update_search_documents
 from users.models import Follow, User
 
+from .coverage_index import mark_recipes_changed
+from .utils import invalidate_shopping_lists
+
+logger = logging.getLogger(__name__)
+
 
 class CustomUserSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
@@ -20,6 +30,8 @@ class CustomUserSerializer(UserSerializer):
                   'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request.user.is_authenticated:
             return obj.following.filter(user=request.user).exists()
@@ -44,10 +56,53 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        urls = {}
+        for name, path in variants.items():
+            if name == 'source':
+                continue
+            url = default_storage.url(path)
+            urls[name] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
 class RecipeShortInfoSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class RecipeCoverageSerializer(RecipeShortInfoSerializer):
+    matched = serializers.IntegerField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+    missing_ingredients = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(RecipeShortInfoSerializer.Meta):
+        fields = RecipeShortInfoSerializer.Meta.fields + (
+            'matched', 'missing', 'missing_ingredients'
+        )
+
+
+class CoverageQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=100
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=100, default=settings.COVERAGE_SEARCH_LIMIT
+    )
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=100
+    )
 
 
 class RecipeIngredientRetrieveSerializer(serializers.ModelSerializer):
@@ -63,8 +118,7 @@ class RecipeIngredientRetrieveSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(), source='ingredient')
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
@@ -72,20 +126,46 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    CHUNK_SIZE = 64 * 1024
+    EXTENSIONS = ('jpeg', 'jpg', 'png', 'gif', 'webp')
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr),
-                               name=f'{get_random_string(length=20)}.{ext}')
+            data = self.decode(data)
         return super().to_internal_value(data)
 
+    def decode(self, data):
+        header, _, encoded = data.partition(';base64,')
+        ext = header.split('/')[-1].lower()
+        if ext not in self.EXTENSIONS:
+            self.fail('invalid_image')
+        if len(encoded) // 4 * 3 > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(
+                'Размер изображения превышает допустимый!'
+            )
+        file = TemporaryUploadedFile(
+            f'{get_random_string(length=20)}.{ext}', f'image/{ext}', 0, None
+        )
+        try:
+            for start in range(0, len(encoded), self.CHUNK_SIZE):
+                file.write(binascii.a2b_base64(
+                    encoded[start:start + self.CHUNK_SIZE]
+                ))
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_image')
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
 
 class CreateRecipeSerializer(serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
-    ingredients = RecipeIngredientCreateSerializer(many=True, write_only=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, write_only=True
+    )
+    ingredients = RecipeIngredientCreateSerializer(many=True, write_only=True,
+                                                   allow_empty=False)
     image = Base64ImageField(required=False)
 
     class Meta:
@@ -100,48 +180,128 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             )
         return value
 
+    @staticmethod
+    def validate_ids(model, ids, field):
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                {field: 'Значения не должны повторяться!'}
+            )
+        missing = set(ids).difference(
+            model.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                {field: f'Не найдены объекты с id {sorted(missing)}'}
+            )
+
+    def validate(self, data):
+        self.validate_ids(Tag, data['tags'], 'tags')
+        self.validate_ids(
+            Ingredient,
+            [ingredient['id'] for ingredient in data['ingredients']],
+            'ingredients'
+        )
+        return data
+
     @staticmethod
     def create_recipe_ingredient(recipe, ingredients):
-        bulk_list = list()
-        for ingredient in ingredients:
-            bulk_list.append(
-                RecipeIngredient(
-                    ingredient=get_object_or_404(
-                        Ingredient,
-                        name=ingredient.get('ingredient').name
-                    ),
-                    recipe=recipe,
-                    amount=ingredient.get('amount')
-                )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient['id'],
+                amount=ingredient['amount']
             )
-        RecipeIngredient.objects.bulk_create(bulk_list)
+            for ingredient in ingredients
+        )
+
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if isinstance(image, TemporaryUploadedFile):
+                image.close()
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_recipe_ingredient(recipe, ingredients)
+        update_search_documents([recipe.pk])
+        mark_recipes_changed([recipe.pk])
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        instance.tags.clear()
-        instance.ingredients.clear()
         for key, data in validated_data.items():
             setattr(instance, key, data)
         instance.save()
-        instance.tags.set(tags)
-        self.create_recipe_ingredient(instance, ingredients)
+        tags_touched = self.update_tags(instance, tags)
+        ingredients_touched = self.update_recipe_ingredients(
+            instance, ingredients
+        )
+        update_search_documents([instance.pk])
+        mark_recipes_changed([instance.pk])
+        logger.debug(
+            'Recipe %s updated: %s tag rows and %s ingredient rows touched',
+            instance.pk, tags_touched, ingredients_touched
+        )
         return instance
 
+    @staticmethod
+    def update_tags(recipe, tags):
+        current = set(recipe.tags.values_list('id', flat=True))
+        to_remove = current.difference(tags)
+        to_add = set(tags).difference(current)
+        if to_remove:
+            recipe.tags.remove(*to_remove)
+        if to_add:
+            recipe.tags.add(*to_add)
+        return len(to_remove) + len(to_add)
+
+    def update_recipe_ingredients(self, recipe, ingredients):
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipe_ingredients.all()
+        }
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        to_delete = [
+            recipe_ingredient.id
+            for ingredient_id, recipe_ingredient in current.items()
+            if ingredient_id not in amounts
+        ]
+        to_update = []
+        for ingredient_id, recipe_ingredient in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != recipe_ingredient.amount:
+                recipe_ingredient.amount = amount
+                to_update.append(recipe_ingredient)
+        to_create = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in current
+        ]
+        RecipeIngredient.objects.filter(id__in=to_delete).delete()
+        RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        self.create_recipe_ingredient(recipe, to_create)
+        if to_delete or to_update or to_create:
+            invalidate_shopping_lists(
+                recipe.cart.values_list('user_id', flat=True)
+            )
+        return len(to_delete) + len(to_update) + len(to_create)
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['tags'] = TagSerializer(instance.tags.all(), many=True).data
         data['ingredients'] = RecipeIngredientRetrieveSerializer(
-            instance.recipe_ingredients.all(), many=True).data
+            instance.recipe_ingredients.select_related('ingredient'),
+            many=True).data
         data['is_favorited'] = False
         data['is_in_shopping_cart'] = False
         return data
@@ -154,12 +314,13 @@ class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     ingredients = RecipeIngredientRetrieveSerializer(
         many=True, source='recipe_ingredients')
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
-                  'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'is_favorited', 'is_in_shopping_cart', 'favorites_count',
+                  'name', 'image', 'image_variants', 'text', 'cooking_time')
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
@@ -190,12 +351,11 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         return data
 
     def get_recipes_count(self, obj):
-        return obj.author.recipes.count()
+        return obj.author.recipes_count
 
     def get_recipes(self, obj):
-        recipes = obj.author.recipes.all()
         serializer = RecipeShortInfoSerializer(
-            recipes, many=True, read_only=True
+            obj.author.latest_recipes, many=True, read_only=True
         )
         return serializer.data
 
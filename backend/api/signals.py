@@ -0,0 +1,150 @@
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from foodgram.db import check_connections
+from recipes.images import schedule_recipe_image
+from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from recipes.search import delete_search_documents, update_search_documents
+from users.models import Follow, User
+
+from .authentication import invalidate_token, invalidate_user
+from .catalog import bump_catalog_version
+from .coverage_index import mark_recipes_changed, reset_coverage_index
+from .feed import backfill_feed, clear_feed, fan_out_recipe
+from .instrumentation import install_execute_wrapper
+from .recipe_cache import (bump_generation, bump_recipe_versions,
+                           invalidate_personal_sets)
+from .utils import invalidate_shopping_lists
+
+
+@receiver(request_started)
+def database_connections_checked(sender, **kwargs):
+    check_connections()
+
+
+@receiver(connection_created)
+def database_connection_created(sender, connection, **kwargs):
+    install_execute_wrapper(connection)
+
+
+@receiver((post_save, post_delete), sender=Cart)
+def cart_changed(sender, instance, **kwargs):
+    invalidate_shopping_lists([instance.user_id])
+
+
+def invalidate_ingredient_shopping_lists(ingredient):
+    invalidate_shopping_lists(Cart.objects.filter(
+        recipe__recipe_ingredients__ingredient=ingredient
+    ).values_list('user_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_ingredient_shopping_lists(instance)
+        update_search_documents(instance.ingredient_recipes.values_list(
+            'recipe_id', flat=True
+        ))
+
+
+# Строки RecipeIngredient удаляются каскадом без сигналов на каждую строку,
+# поэтому затронутые списки покупок собираются до удаления ингредиента.
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_deleting(sender, instance, **kwargs):
+    invalidate_ingredient_shopping_lists(instance)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_catalog_changed(sender, **kwargs):
+    bump_catalog_version('ingredients')
+    bump_generation()
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    reset_coverage_index()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_catalog_changed(sender, **kwargs):
+    bump_catalog_version('tags')
+    bump_generation()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    if (instance.image
+            and instance.image.name != instance.image_variants.get('source')):
+        schedule_recipe_image(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    bump_recipe_versions([instance.pk])
+    if created:
+        fan_out_recipe(instance)
+        bump_generation()
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    delete_search_documents([instance.pk])
+    mark_recipes_changed([instance.pk])
+    bump_recipe_versions([instance.pk])
+    bump_generation()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if (action not in ('post_add', 'post_remove', 'post_clear')
+            or action != 'post_clear' and not pk_set):
+        return
+    bump_recipe_versions((pk_set or ()) if reverse else [instance.pk])
+    bump_generation()
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    bump_recipe_versions(
+        instance.recipes.values_list('id', flat=True)
+    )
+
+
+@receiver(post_save, sender=User)
+def user_auth_changed(sender, instance, update_fields, **kwargs):
+    if update_fields != frozenset(('last_login',)):
+        invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Follow)
+def personal_sets_changed(sender, instance, **kwargs):
+    invalidate_personal_sets(instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        backfill_feed(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    clear_feed(instance)
@@ -0,0 +1,886 @@
+import re
+import threading
+import time
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache, caches
+from django.db import connection, connections, transaction
+from django.http import QueryDict
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from foodgram.db import ReplicaRouter, _read_alias
+from recipes.models import (Cart, Favorite, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, RecipeSearchDocument, Tag)
+from recipes.search import SEARCH_CONFIG
+from users.models import Follow, User
+
+from . import coverage_index
+from .catalog import get_catalog_version
+from .authentication import USER_KEY, get_cached_user
+from .coverage_index import (CHANGE_KEY, CoverageIndex, mark_recipes_changed,
+                             reset_coverage_index)
+from .feed import FAN_IN_KEY, FAN_IN_LOCK_KEY, get_fan_in_authors
+from .filters import RecipeFilter
+from .utils import (add_recipes_to_list, get_shopping_list,
+                    invalidate_shopping_lists)
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def clear_caches():
+    for alias in ('default', 'recipes'):
+        caches[alias].clear()
+
+
+class RecipeQueryCountTest(TestCase):
+    RECIPES = 100
+    # count, страница рецептов, авторы, теги, ингредиенты.
+    LIST_QUERIES = 5
+    # рецепт, авторы, теги, ингредиенты.
+    RETRIEVE_QUERIES = 4
+    # избранное, список покупок и подписки пользователя.
+    PERSONAL_QUERIES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = [
+            User.objects.create(username=f'author{number}',
+                                email=f'author{number}@ya.ru')
+            for number in range(5)
+        ]
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(10)
+        ]
+        Recipe.objects.bulk_create(
+            Recipe(author=authors[number % len(authors)],
+                   name=f'Рецепт {number}', text='Описание', cooking_time=10)
+            for number in range(cls.RECIPES)
+        )
+        # bulk_create заполняет id только на PostgreSQL.
+        recipes = list(Recipe.objects.order_by('id'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in tags[:2]
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=100)
+            for recipe in recipes for ingredient in ingredients[:4]
+        )
+        cls.recipe = recipes[0]
+        cls.user = authors[0]
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        for limit in (1, 6, 100):
+            with self.subTest(limit=limit):
+                clear_caches()
+                with self.assertNumQueries(self.LIST_QUERIES):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': limit}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_authenticated_list_queries_do_not_depend_on_page_size(self):
+        self.client.force_authenticate(self.user)
+        for limit in (1, 6, 100):
+            with self.subTest(limit=limit):
+                clear_caches()
+                with self.assertNumQueries(
+                    self.LIST_QUERIES + self.PERSONAL_QUERIES
+                ):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': limit}
+                    )
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_retrieve_queries(self):
+        with self.assertNumQueries(self.RETRIEVE_QUERIES):
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 4)
+
+
+class IngredientSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('мука', 'мука ржаная', 'молоко', 'соль',
+                         'рисовая мука')
+        )
+
+    def setUp(self):
+        clear_caches()
+
+    def search(self, name):
+        response = APIClient().get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_matches_come_first(self):
+        self.assertEqual(self.search('Мука'),
+                         ['мука', 'мука ржаная', 'рисовая мука'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_limit_applies_to_every_query(self):
+        self.assertEqual(self.search('мук'), ['мука', 'мука ржаная'])
+        self.assertEqual(self.search(''), ['молоко', 'мука'])
+
+
+class CatalogCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+
+    def test_version_changes_after_commit(self):
+        version = get_catalog_version('ingredients')
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Ingredient.objects.create(name='соль', measurement_unit='г')
+            self.assertEqual(get_catalog_version('ingredients'), version)
+        self.assertNotEqual(get_catalog_version('ingredients'), version)
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        for header, name in (('HTTP_IF_NONE_MATCH', 'ETag'),
+                             ('HTTP_IF_MODIFIED_SINCE', 'Last-Modified')):
+            with self.subTest(header=header):
+                with self.assertNumQueries(0):
+                    cached = self.client.get(
+                        '/api/tags/', **{header: response[name]}
+                    )
+                self.assertEqual(cached.status_code, 304)
+                self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_tag_change_changes_etag(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 2)
+
+
+class RecipeWriteQueryCountTest(TestCase):
+    SIZES = (1, 30, 200)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(2 * max(cls.SIZES))
+        )
+        cls.ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, name, ingredient_ids, amount=10):
+        return {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 15,
+            'tags': [self.tag.pk],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': amount}
+                for ingredient_id in ingredient_ids
+            ],
+        }
+
+    def count_queries(self, method, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(*args, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        return len(queries), response
+
+    # Число запросов зависит от СУБД (например, запись поискового
+    # документа), поэтому сравнивается с рецептом из одного ингредиента.
+    def test_queries_do_not_depend_on_ingredient_count(self):
+        counts = {'create': [], 'replace': [], 'update': []}
+        for size in self.SIZES:
+            clear_caches()
+            first = self.ingredient_ids[:size]
+            second = self.ingredient_ids[size:2 * size]
+            queries, response = self.count_queries(
+                self.client.post, '/api/recipes/',
+                self.payload(f'Рецепт {size}', first)
+            )
+            counts['create'].append(queries)
+            url = f'/api/recipes/{response.data["id"]}/'
+            counts['replace'].append(self.count_queries(
+                self.client.patch, url, self.payload(f'Рецепт {size}', second)
+            )[0])
+            counts['update'].append(self.count_queries(
+                self.client.patch, url,
+                self.payload(f'Рецепт {size}', second, amount=20)
+            )[0])
+            self.assertEqual(
+                len(self.client.get(url).data['ingredients']), size
+            )
+        for action, values in counts.items():
+            with self.subTest(action=action):
+                self.assertEqual(values, [values[0]] * len(self.SIZES))
+
+
+class RecipeTagFilterTest(TestCase):
+    RECIPES = 10000
+    TAGS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(cls.TAGS)
+        ]
+        Recipe.objects.bulk_create((
+            Recipe(author=author, name=f'Рецепт {number}', text='Описание',
+                   cooking_time=10)
+            for number in range(cls.RECIPES)
+        ), batch_size=1000)
+        # Теги рецепта задаются битами номера: встречаются все сочетания
+        # из пяти тегов, включая рецепты без тегов.
+        cls.recipe_tags = {
+            recipe_id: {
+                tag.slug for bit, tag in enumerate(cls.tags)
+                if number >> bit & 1
+            }
+            for number, recipe_id in enumerate(
+                Recipe.objects.order_by('id').values_list('id', flat=True)
+            )
+        }
+        tag_ids = {tag.slug: tag.pk for tag in cls.tags}
+        Recipe.tags.through.objects.bulk_create((
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_ids[slug])
+            for recipe_id, slugs in cls.recipe_tags.items()
+            for slug in slugs
+        ), batch_size=1000)
+
+    def setUp(self):
+        clear_caches()
+
+    def expected(self, slugs, match):
+        check = all if match == 'all' else any
+        return {
+            recipe_id for recipe_id, tags in self.recipe_tags.items()
+            if check(slug in tags for slug in slugs)
+        }
+
+    def filter(self, slugs, match):
+        return RecipeFilter(
+            data=QueryDict(urlencode(
+                {'tags': slugs, 'tags_match': match}, doseq=True
+            )),
+            queryset=Recipe.objects.all(),
+            request=APIRequestFactory().get('/api/recipes/'),
+        ).qs
+
+    def test_no_duplicates_and_stable_counts(self):
+        for match in ('any', 'all'):
+            for size in (1, 2, self.TAGS):
+                slugs = [tag.slug for tag in self.tags[:size]]
+                with self.subTest(match=match, tags=size):
+                    queryset = self.filter(slugs, match)
+                    ids = list(queryset.values_list('id', flat=True))
+                    self.assertEqual(len(ids), len(set(ids)))
+                    self.assertEqual(set(ids), self.expected(slugs, match))
+                    self.assertEqual(queryset.count(), len(ids))
+
+    def test_paginated_count(self):
+        slugs = [tag.slug for tag in self.tags[:3]]
+        for match in ('any', 'all'):
+            with self.subTest(match=match):
+                response = APIClient().get('/api/recipes/', {
+                    'tags': slugs, 'tags_match': match, 'limit': 100
+                })
+                ids = [recipe['id'] for recipe in response.data['results']]
+                self.assertEqual(response.data['count'],
+                                 len(self.expected(slugs, match)))
+                self.assertEqual(len(ids), len(set(ids)))
+
+
+class InstrumentationTest(TestCase):
+    URLS = ('/api/users/{user}/', '/api/recipes/coverage/?ingredients=1',
+            '/api/recipes/download_shopping_cart/')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.token = Token.objects.create(user=cls.user)
+
+    @staticmethod
+    def count_queries(response):
+        return int(SERVER_TIMING_QUERIES.search(
+            response['Server-Timing']
+        ).group(1))
+
+    # AsyncClient в Django 3.2 передаёт именованные аргументы как заголовки
+    # без преобразования из формата META.
+    def get(self, client, url):
+        clear_caches()
+        header = ('authorization' if isinstance(client, AsyncClient)
+                  else 'HTTP_AUTHORIZATION')
+        return client.get(url.format(user=self.user.pk),
+                          **{header: f'Token {self.token.key}'})
+
+    def test_wsgi_counts_queries(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.get(Client(), url)
+                self.assertEqual(self.count_queries(response), len(queries))
+                self.assertGreater(len(queries), 0)
+
+    # Синхронные представления под ASGI выполняются в отдельном потоке со
+    # своим соединением, поэтому эталоном служит счёт того же запроса
+    # через WSGI.
+    async def test_asgi_counts_queries_of_sync_views(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                expected = self.count_queries(
+                    await sync_to_async(self.get)(Client(), url)
+                )
+                response = await self.get(AsyncClient(), url)
+                self.assertEqual(self.count_queries(response), expected)
+
+
+class RecipeCursorPaginationTest(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_cursor_rejects_custom_ordering(self):
+        for params in ({'search': 'суп'}, {'ordering': 'popular'}):
+            with self.subTest(params=params):
+                response = APIClient().get(
+                    '/api/recipes/', {'pagination': 'cursor', **params}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('pagination', response.data)
+
+    def test_cursor_without_ordering(self):
+        response = APIClient().get('/api/recipes/', {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, 200)
+
+
+class CoverageIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.flour, cls.milk, cls.egg = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'молоко', 'яйца')
+        )
+        cls.pancakes = cls.create_recipe('Блины', cls.flour, cls.milk)
+
+    @classmethod
+    def create_recipe(cls, name, *ingredients):
+        recipe = Recipe.objects.create(author=cls.author, name=name,
+                                       text='Описание', cooking_time=10)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients
+        )
+        return recipe
+
+    def setUp(self):
+        clear_caches()
+        self.index = CoverageIndex()
+
+    def search(self, *ingredients):
+        return self.index.search(
+            [ingredient.pk for ingredient in ingredients], None, 10
+        )
+
+    def publish(self, *recipes):
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_recipes_changed([recipe.pk for recipe in recipes])
+
+    def test_lost_change_triggers_rebuild(self):
+        self.assertEqual(self.search(self.flour),
+                         [(self.pancakes.pk, 1, 1)])
+        omelette = self.create_recipe('Омлет', self.milk, self.egg)
+        porridge = self.create_recipe('Каша', self.milk)
+        self.publish(omelette, porridge)
+        cache.delete(CHANGE_KEY.format(1))
+        # Потерянная запись сначала считается ещё не записанной.
+        self.assertEqual(self.search(self.milk), [(self.pancakes.pk, 1, 1)])
+        with mock.patch.object(coverage_index, 'GAP_TIMEOUT', 0):
+            found = self.search(self.milk)
+        self.assertEqual(found, [
+            (porridge.pk, 1, 0), (omelette.pk, 1, 1), (self.pancakes.pk, 1, 1)
+        ])
+
+    def test_changed_recipe_moves_between_postings(self):
+        self.search(self.flour)
+        RecipeIngredient.objects.filter(recipe=self.pancakes,
+                                        ingredient=self.flour).delete()
+        RecipeIngredient.objects.create(recipe=self.pancakes,
+                                        ingredient=self.egg, amount=2)
+        deleted = self.create_recipe('Удалённый', self.flour)
+        self.publish(self.pancakes, deleted)
+        self.assertEqual(self.search(self.flour), [(deleted.pk, 1, 0)])
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+        self.assertEqual(self.search(self.flour), [])
+        self.assertEqual(self.search(self.egg, self.milk),
+                         [(self.pancakes.pk, 2, 0)])
+        self.assertNotIn(self.flour.pk, self.index._postings)
+
+    # Пока один поток строит индекс заново, поиск отвечает по прежнему.
+    def test_search_is_not_blocked_by_rebuild(self):
+        self.search(self.flour)
+        built = CoverageIndex._build()
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_build():
+            started.set()
+            finish.wait(5)
+            return built
+
+        with mock.patch.object(CoverageIndex, '_build',
+                               staticmethod(slow_build)):
+            with self.captureOnCommitCallbacks(execute=True):
+                reset_coverage_index()
+            builder = threading.Thread(target=self.search, args=(self.flour,))
+            builder.start()
+            self.assertTrue(started.wait(5))
+            self.assertEqual(self.search(self.milk),
+                             [(self.pancakes.pk, 1, 1)])
+            self.assertTrue(builder.is_alive())
+            finish.set()
+            builder.join()
+        self.assertIs(self.index._postings, built[0])
+
+
+class FanInLockTest(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_lock_of_another_process_is_kept(self):
+        cache.add(FAN_IN_LOCK_KEY, 1, 60)
+        get_fan_in_authors()
+        get_fan_in_authors(refresh=True)
+        self.assertIsNotNone(cache.get(FAN_IN_LOCK_KEY))
+
+    def test_own_lock_is_released(self):
+        get_fan_in_authors()
+        state = cache.get(FAN_IN_KEY)
+        cache.set(FAN_IN_KEY, {**state, 'expires': 0}, None)
+        get_fan_in_authors()
+        self.assertIsNone(cache.get(FAN_IN_LOCK_KEY))
+        self.assertGreater(cache.get(FAN_IN_KEY)['expires'], 0)
+
+
+class RecipeListWriteRoutingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.recipe = Recipe.objects.create(author=cls.user, name='Блины',
+                                           text='Описание', cooking_time=10)
+
+    # Чтение в запросе направлено на реплику, которой нет: UPDATE ...
+    # RETURNING должен уйти на основную базу независимо от роутера.
+    def test_counter_update_goes_to_primary(self):
+        token = _read_alias.set('missing_replica')
+        try:
+            recipes = add_recipes_to_list(Favorite, 'favorites_count',
+                                          self.user.pk, [self.recipe.pk])
+        finally:
+            _read_alias.reset(token)
+        self.assertEqual([recipe.favorites_count for recipe in recipes], [1])
+
+
+class CachedAuthenticationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='cook', email='cook@ya.ru', password='secret-pass'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_password_hash_is_not_cached(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        cached = cache.get(USER_KEY.format(self.user.pk))
+        self.assertNotIn('password', cached)
+        self.assertNotIn(self.user.password, cached.values())
+        user = get_cached_user(self.user.pk)
+        self.assertEqual(user.username, self.user.username)
+        self.assertTrue(user.check_password('secret-pass'))
+
+    def test_cached_user_is_served_without_user_query(self):
+        self.client.get('/api/users/me/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/users/me/').status_code,
+                             200)
+        self.assertFalse(any('"users_user"' in query['sql']
+                             and '"password"' in query['sql']
+                             for query in queries))
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/users/me/')
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+class ShoppingListCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.recipe = Recipe.objects.create(author=cls.user, name='Блины',
+                                           text='Описание', cooking_time=10)
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, amount=200,
+            ingredient=Ingredient.objects.create(name='мука',
+                                                 measurement_unit='г')
+        )
+
+    def setUp(self):
+        clear_caches()
+
+    def test_cart_change_is_seen_after_commit(self):
+        self.assertEqual(get_shopping_list(self.user), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Cart.objects.create(user=self.user, recipe=self.recipe)
+        self.assertEqual(get_shopping_list(self.user), [('мука', 'г', 200)])
+        with self.assertNumQueries(0):
+            get_shopping_list(self.user)
+
+    # Сброс после фиксации приходится на момент, когда читающий запрос уже
+    # агрегировал старые строки: записанный им список не должен отдаваться
+    # следующим запросам. Строка корзины добавляется в обход сигналов.
+    def test_list_read_before_commit_is_not_served(self):
+        def commit_during_read(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if 'SUM' in sql:
+                with self.captureOnCommitCallbacks(execute=True):
+                    invalidate_shopping_lists([self.user.pk])
+            return result
+
+        with connection.execute_wrapper(commit_during_read):
+            self.assertEqual(get_shopping_list(self.user), [])
+        Cart.objects.bulk_create([Cart(user=self.user, recipe=self.recipe)])
+        self.assertEqual(get_shopping_list(self.user), [('мука', 'г', 200)])
+
+
+class RecipeResponseCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='cook', email='cook@ya.ru')
+        for name in ('Блины', 'Оладьи'):
+            Recipe.objects.create(author=cls.author, name=name,
+                                  text='Описание', cooking_time=10)
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+
+    def test_repeat_request_is_served_from_cache(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_new_recipe_is_listed_after_commit(self):
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(author=self.author, name='Сырники',
+                                  text='Описание', cooking_time=10)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 3)
+
+    def test_changed_recipe_is_not_served_from_cache(self):
+        recipe = Recipe.objects.get(name='Блины')
+        self.client.get(f'/api/recipes/{recipe.pk}/')
+        recipe.name = 'Тонкие блины'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Тонкие блины')
+
+    @override_settings(ALLOWED_HOSTS=['*'])
+    def test_links_are_cached_per_host_and_scheme(self):
+        for host, secure in (('foodgram.ru', False), ('127.0.0.1', False),
+                             ('foodgram.ru', True)):
+            with self.subTest(host=host, secure=secure):
+                response = self.client.get(
+                    '/api/recipes/', {'limit': 1}, HTTP_HOST=host,
+                    secure=secure
+                )
+                scheme = 'https' if secure else 'http'
+                self.assertTrue(response.data['next'].startswith(
+                    f'{scheme}://{host}/'
+                ))
+
+
+class RecipeSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.ingredients = {
+            name: Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('творог', 'мука', 'яйца', 'крупа')
+        }
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, name, ingredients, text='Описание'):
+        return {
+            'name': name,
+            'text': text,
+            'cooking_time': 15,
+            'tags': [self.tag.pk],
+            'ingredients': [
+                {'id': self.ingredients[ingredient].pk, 'amount': 100}
+                for ingredient in ingredients
+            ],
+        }
+
+    def create(self, name, ingredients, text='Описание'):
+        response = self.client.post(
+            '/api/recipes/', self.payload(name, ingredients, text),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def edit(self, recipe_id, name, ingredients):
+        response = self.client.patch(
+            f'/api/recipes/{recipe_id}/', self.payload(name, ingredients),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def search(self, query):
+        response = APIClient().get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    # Название весит больше ингредиентов, ингредиенты — больше описания.
+    def test_matches_are_ranked_by_field(self):
+        self.create('Омлет', ['яйца'], text='Подавать с творогом.')
+        self.create('Блины с творогом', ['мука', 'яйца'])
+        self.create('Сырники', ['творог', 'мука'])
+        self.create('Каша', ['крупа'])
+        self.assertEqual(self.search('творог'),
+                         ['Блины с творогом', 'Сырники', 'Омлет'])
+
+    def test_all_words_must_match(self):
+        self.create('Блины с творогом', ['мука', 'яйца'])
+        self.create('Сырники', ['творог', 'мука'])
+        self.assertEqual(self.search('блины творог'), ['Блины с творогом'])
+        self.assertEqual(self.search('пельмени'), [])
+
+    def test_edited_recipe_is_found_by_new_name(self):
+        recipe_id = self.create('Сырники', ['творог'])
+        self.edit(recipe_id, 'Запеканка', ['крупа'])
+        self.assertEqual(self.search('запеканка'), ['Запеканка'])
+        self.assertEqual(self.search('сырники'), [])
+        self.assertEqual(self.search('творог'), [])
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'tsvector хранится только на PostgreSQL')
+    def test_document_follows_recipe_changes(self):
+        def matches(recipe_id, query):
+            return RecipeSearchDocument.objects.filter(
+                recipe_id=recipe_id,
+                vector=SearchQuery(query, config=SEARCH_CONFIG)
+            ).exists()
+
+        recipe_id = self.create('Сырники', ['творог'])
+        self.assertTrue(matches(recipe_id, 'сырники'))
+        self.assertTrue(matches(recipe_id, 'творог'))
+        self.edit(recipe_id, 'Запеканка', ['крупа'])
+        self.assertTrue(matches(recipe_id, 'запеканка'))
+        self.assertTrue(matches(recipe_id, 'крупа'))
+        self.assertFalse(matches(recipe_id, 'сырники'))
+        self.assertFalse(matches(recipe_id, 'творог'))
+
+
+class FeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author, cls.popular = (
+            User.objects.create(username=name, email=f'{name}@ya.ru')
+            for name in ('reader', 'author', 'popular')
+        )
+        for number in range(3):
+            cls.create_recipe(cls.author, f'Рецепт {number}')
+
+    @staticmethod
+    def create_recipe(author, name):
+        return Recipe.objects.create(author=author, name=name,
+                                     text='Описание', cooking_time=10)
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def feed(self, client=None):
+        response = (client or self.client).get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def subscribe(self, author):
+        response = self.client.post(f'/api/users/{author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_new_recipe_reaches_followers(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(self.author, 'Новый рецепт')
+        self.assertEqual(self.feed()[0], 'Новый рецепт')
+        stranger = APIClient()
+        stranger.force_authenticate(self.popular)
+        self.assertEqual(self.feed(stranger), [])
+
+    @override_settings(FEED_BACKFILL_LIMIT=2)
+    def test_subscribe_backfills_latest_recipes(self):
+        self.assertEqual(self.feed(), [])
+        self.subscribe(self.author)
+        self.assertEqual(self.feed(), ['Рецепт 2', 'Рецепт 1'])
+
+    def test_unsubscribe_removes_recipes(self):
+        self.subscribe(self.author)
+        response = self.client.delete(
+            f'/api/users/{self.author.pk}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.feed(), [])
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+
+    # У popular два подписчика, и после пересчёта множества его рецепты не
+    # раскладываются по лентам, а добавляются к ленте при чтении.
+    @override_settings(FEED_FAN_IN_FOLLOWERS=2)
+    def test_fan_in_authors_are_merged_at_read_time(self):
+        Follow.objects.create(user=self.author, author=self.popular)
+        self.subscribe(self.popular)
+        self.subscribe(self.author)
+        self.assertEqual(get_fan_in_authors(refresh=True), {self.popular.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            popular = self.create_recipe(self.popular, 'Популярный рецепт')
+            self.create_recipe(self.author, 'Свежий рецепт')
+        self.assertFalse(FeedEntry.objects.filter(recipe=popular).exists())
+        self.assertEqual(self.feed(), [
+            'Свежий рецепт', 'Популярный рецепт',
+            'Рецепт 2', 'Рецепт 1', 'Рецепт 0',
+        ])
+
+
+# Реплика в тесте — то же соединение, что и основная база, под другим
+# алиасом: проверяется выбор алиаса роутером, а не репликация.
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipe = Recipe.objects.create(author=cls.user, name='Блины',
+                                           text='Описание', cooking_time=10)
+
+    def setUp(self):
+        clear_caches()
+        connections['replica'] = connections['default']
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.aliases = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            alias = db_for_read(router, model, **hints)
+            self.aliases.append((model, alias))
+            return alias
+
+        patcher = mock.patch.object(ReplicaRouter, 'db_for_read', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, method, url, client=None):
+        caches['recipes'].clear()
+        self.aliases.clear()
+        response = getattr(client or self.client, method)(url)
+        self.assertLess(response.status_code, 300)
+        return {alias for model, alias in self.aliases if model is Recipe}
+
+    def test_safe_request_reads_from_replica(self):
+        self.assertEqual(self.request('get', '/api/recipes/'), {'replica'})
+
+    def test_write_pins_client_to_primary(self):
+        self.assertEqual(
+            self.request('post', f'/api/recipes/{self.recipe.pk}/favorite/'),
+            {'default'}
+        )
+        self.assertEqual(self.request('get', '/api/recipes/'), {'default'})
+        self.assertEqual(self.request('get', '/api/recipes/', APIClient()),
+                         {'replica'})
+
+    @override_settings(PRIMARY_STICKY_SECONDS=5)
+    def test_pin_expires(self):
+        self.request('post', f'/api/recipes/{self.recipe.pk}/favorite/')
+        later = time.time() + 6
+        with mock.patch('django.core.cache.backends.locmem.time') as clock:
+            clock.time.return_value = later
+            self.assertEqual(self.request('get', '/api/recipes/'),
+                             {'replica'})
+
+    def test_shopping_list_is_filled_from_primary(self):
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, amount=200,
+            ingredient=Ingredient.objects.create(name='мука',
+                                                 measurement_unit='г')
+        )
+        Cart.objects.create(user=self.user, recipe=self.recipe)
+        self.request('get', '/api/recipes/download_shopping_cart/')
+        self.assertEqual(
+            {alias for model, alias in self.aliases
+             if model is RecipeIngredient},
+            {'default'}
+        )
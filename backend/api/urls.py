@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .instrumentation import metrics
 from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
                     TagViewSet)
 
@@ -13,7 +15,11 @@ v1_router.register('tags', TagViewSet, basename='tags')
 v1_router.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
+    path("metrics/", metrics, name="metrics"),
     path("", include(v1_router.urls)),
     path("", include("djoser.urls")),
     path("auth/", include("djoser.urls.authtoken")),
 ]
+
+if settings.JWT_AUTHENTICATION:
+    urlpatterns.append(path("auth/", include("djoser.urls.jwt")))
@@ -1,24 +1,201 @@
-from django.db.models import Sum
-from django.http.response import HttpResponse
-
-from recipes.models import RecipeIngredient
-
-
-def download_shopping_list(request):
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__cart__user=request.user
-    ).values(
-        'ingredient__name',
-        'ingredient__measurement_unit',
-    ).annotate(amount=Sum('amount')).order_by('ingredient__name')
-    shopping_list = 'Список покупок:\n\n'
-    shopping_list += '\n'.join([
-        f'- {ingredient["ingredient__name"]} {ingredient["amount"]} '
-        f'{ingredient["ingredient__measurement_unit"]}'
-        for ingredient in ingredients
-    ])
-    response = HttpResponse(shopping_list, content_type='text/plain')
+import csv
+import io
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import Exists, F, OuterRef, Sum, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, RowNumber
+from django.http.response import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from foodgram.db import use_primary
+from recipes.models import Recipe, RecipeIngredient
+from users.models import Follow
+
+SHOPPING_LIST_VERSION_KEY = 'shopping_list:{}:version'
+SHOPPING_LIST_CACHE_KEY = 'shopping_list:{}:{}'
+RECIPE_SHORT_INFO_COLUMNS = 'id, name, image, image_variants, cooking_time'
+PDF_FONT = 'ShoppingListFont'
+
+
+def annotate_is_subscribed(authors, user):
+    if not user.is_authenticated:
+        return authors
+    return authors.annotate(
+        is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('pk'))
+        )
+    )
+
+
+def get_latest_recipes(author_ids, limit):
+    ranked = Recipe.objects.filter(author__in=author_ids).annotate(
+        recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=F('id').desc(),
+        )
+    ).order_by().values('id', 'recipe_rank')
+    sql, params = ranked.query.sql_with_params()
+    return Recipe.objects.filter(id__in=RawSQL(
+        f'SELECT ranked.id FROM ({sql}) ranked '
+        f'WHERE ranked.recipe_rank <= %s',
+        (*params, limit)
+    ))
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+# Добавление в избранное или список покупок одним INSERT ... ON CONFLICT DO
+# NOTHING: повторный запрос ничего не вставит вместо IntegrityError, а
+# несуществующие рецепты отсеет SELECT. Возвращает добавленные рецепты с
+# увеличенным счётчиком, прочитанные тем же UPDATE ... RETURNING.
+def add_recipes_to_list(model, counter, user_id, recipe_ids):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {model._meta.db_table} (user_id, recipe_id) '
+            f'SELECT %s, id FROM recipes_recipe '
+            f'WHERE id IN ({placeholders(recipe_ids)}) '
+            f'ON CONFLICT (user_id, recipe_id) DO NOTHING '
+            f'RETURNING recipe_id',
+            [user_id, *recipe_ids]
+        )
+        added = [row[0] for row in cursor.fetchall()]
+    if not added:
+        return []
+    # raw() выбирает базу через db_for_read, а это запись.
+    return list(Recipe.objects.raw(
+        f'UPDATE recipes_recipe SET {counter} = {counter} + 1 '
+        f'WHERE id IN ({placeholders(added)}) '
+        f'RETURNING {RECIPE_SHORT_INFO_COLUMNS}',
+        added
+    ).using(DEFAULT_DB_ALIAS))
+
+
+def remove_recipes_from_list(model, counter, user_id, recipe_ids):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {model._meta.db_table} WHERE user_id = %s '
+            f'AND recipe_id IN ({placeholders(recipe_ids)}) '
+            f'RETURNING recipe_id',
+            [user_id, *recipe_ids]
+        )
+        removed = [row[0] for row in cursor.fetchall()]
+    if removed:
+        Recipe.objects.filter(id__in=removed).update(
+            **{counter: Greatest(F(counter) - 1, 0)}
+        )
+    return removed
+
+
+def get_shopping_list_version(user_id):
+    key = SHOPPING_LIST_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(key, version, None):
+            version = cache.get(key)
+    return version
+
+
+# Список хранится под версией пользователя, прочитанной до агрегации. Запрос,
+# начавшийся до фиксации изменений, запишет старый список под старой версией,
+# а после фиксации читается уже новая.
+def get_shopping_list(user):
+    key = SHOPPING_LIST_CACHE_KEY.format(
+        user.id, get_shopping_list_version(user.id)
+    )
+    ingredients = cache.get(key)
+    if ingredients is None:
+        # Список кешируется на сутки, поэтому читается с основной базы:
+        # отставание реплики сохранилось бы в нём дольше привязки клиента.
+        with use_primary():
+            ingredients = list(RecipeIngredient.objects.filter(
+                recipe__cart__user=user
+            ).values(
+                'ingredient__name',
+                'ingredient__measurement_unit',
+            ).annotate(amount=Sum('amount')).order_by(
+                'ingredient__name'
+            ).values_list(
+                'ingredient__name', 'ingredient__measurement_unit', 'amount'
+            ))
+        cache.set(key, ingredients, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return ingredients
+
+
+def invalidate_shopping_lists(user_ids):
+    versions = {
+        SHOPPING_LIST_VERSION_KEY.format(user_id): uuid4().hex
+        for user_id in user_ids
+    }
+    if versions:
+        transaction.on_commit(lambda: cache.set_many(versions, None))
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def render_txt(ingredients):
+    yield 'Список покупок:\n\n'
+    for name, measurement_unit, amount in ingredients:
+        yield f'- {name} {amount} {measurement_unit}\n'
+
+
+def render_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, measurement_unit, amount in ingredients:
+        yield writer.writerow((name, amount, measurement_unit))
+
+
+def render_pdf(ingredients):
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT, settings.SHOPPING_LIST_PDF_FONT)
+        )
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    page.setFont(PDF_FONT, 16)
+    page.drawString(50, height - 50, 'Список покупок:')
+    page.setFont(PDF_FONT, 12)
+    y = height - 80
+    for name, measurement_unit, amount in ingredients:
+        if y < 50:
+            page.showPage()
+            page.setFont(PDF_FONT, 12)
+            y = height - 50
+        page.drawString(50, y, f'- {name} {amount} {measurement_unit}')
+        y -= 20
+    page.save()
+    buffer.seek(0)
+    return buffer
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (render_txt, 'text/plain'),
+    'csv': (render_csv, 'text/csv'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
+
+
+def download_shopping_list(ingredients, file_format):
+    render, content_type = SHOPPING_LIST_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        render(ingredients), content_type=content_type
+    )
     response['Content-Disposition'] = (
-        'attachment; filename="shopping_list.txt"'
+        f'attachment; filename="shopping_list.{file_format}"'
     )
     return response
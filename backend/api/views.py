@@ -1,38 +1,79 @@
-from django.db.models import Exists, OuterRef
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (BooleanField, Count, Prefetch, Value,
+                              prefetch_related_objects)
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework import permissions, serializers, status, pagination
+from rest_framework import permissions, serializers, status
 from rest_framework.decorators import action
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, Tag)
 from users.models import Follow, User
 
-from .filters import IngredientFilter, RecipeFilter
+from .catalog import CatalogCacheMixin
+from .coverage_index import coverage_index
+from .feed import get_feed
+from .filters import RecipeFilter
+from .ingredient_index import ingredient_index
+from .pagination import (FeedCursorPagination, PageLimitPagination,
+                         RecipeCursorPagination)
 from .permissions import IsAuthorOrAdminOrReadOnly
-from .serializers import (CreateRecipeSerializer, CustomUserSerializer,
-                          IngredientSerializer, RecipeSerializer,
-                          RecipeShortInfoSerializer, SubscriptionSerializer,
-                          TagSerializer)
-from .utils import download_shopping_list
+from .recipe_cache import (RecipeCacheMixin, bump_recipe_versions,
+                           invalidate_personal_sets, overlay_personal_data)
+from .serializers import (CoverageQuerySerializer, CreateRecipeSerializer,
+                          CustomUserSerializer, IngredientSerializer,
+                          RecipeBatchSerializer, RecipeCoverageSerializer,
+                          RecipeSerializer, RecipeShortInfoSerializer,
+                          SubscriptionSerializer, TagSerializer)
+from .utils import (SHOPPING_LIST_FORMATS, add_recipes_to_list,
+                    annotate_is_subscribed, download_shopping_list,
+                    get_latest_recipes, get_shopping_list,
+                    invalidate_shopping_lists, remove_recipes_from_list)
 
 
 class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    pagination_class = PageLimitPagination
+
+    def _prefetch_subscriptions(self, subscriptions):
+        authors = annotate_is_subscribed(
+            User.objects.annotate(recipes_count=Count('recipes')),
+            self.request.user
+        )
+        recipes_limit = self.request.query_params.get('recipes_limit', '')
+        if recipes_limit.isdigit():
+            recipes = get_latest_recipes(
+                [subscription.author_id for subscription in subscriptions],
+                int(recipes_limit)
+            )
+        else:
+            recipes = Recipe.objects.all()
+        prefetch_related_objects(
+            subscriptions,
+            Prefetch('author', queryset=authors),
+            Prefetch('author__recipes', queryset=recipes,
+                     to_attr='latest_recipes'),
+        )
+        return subscriptions
 
     @action(methods=('GET',),
             url_path='subscriptions', detail=False,
             permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
         user = request.user
-        queryset = Follow.objects.filter(user=user)
-        pages = self.paginate_queryset(queryset)
+        queryset = Follow.objects.filter(user=user).order_by('-id')
+        pages = self._prefetch_subscriptions(self.paginate_queryset(queryset))
         serializer = SubscriptionSerializer(
             pages, many=True, context={'request': request}
         )
@@ -45,7 +86,8 @@ class CustomUserViewSet(UserViewSet):
         user = request.user
         if request.method == 'POST':
             subscription = Follow.objects.create(
-                user=user, author=get_object_or_404(User, id=id))
+                user=user, author_id=get_object_or_404(User, id=id).id)
+            self._prefetch_subscriptions([subscription])
             serializer = SubscriptionSerializer(
                 subscription,
                 context={'request': request},
@@ -60,49 +102,72 @@ class CustomUserViewSet(UserViewSet):
                 status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(CatalogCacheMixin, ReadOnlyModelViewSet):
+    catalog = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (permissions.AllowAny,)
     pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogCacheMixin, ReadOnlyModelViewSet):
+    catalog = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    filter_backends = (IngredientFilter,)
-    search_fields = ('^name',)
     pagination_class = None
 
+    def get_catalog_data(self, request, token):
+        return ingredient_index.search(
+            request.query_params.get('name', ''),
+            settings.INGREDIENT_SEARCH_LIMIT
+        )
+
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(RecipeCacheMixin, ModelViewSet):
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
-    pagination_class = pagination.PageNumberPagination
+    pagination_class = PageLimitPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    # Курсор построен по -id, поэтому с сортировкой по релевантности или
+    # популярности он несовместим.
+    CURSOR_INCOMPATIBLE = ('search', 'ordering')
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if 'cursor' in params or params.get('pagination') == 'cursor':
+                conflicts = [
+                    name for name in self.CURSOR_INCOMPATIBLE
+                    if params.get(name)
+                ]
+                if conflicts:
+                    raise serializers.ValidationError({
+                        'pagination': 'Курсорная пагинация несовместима с '
+                                      f'параметрами: {", ".join(conflicts)}.'
+                    })
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
-        if self.request.user.is_authenticated:
-            queryset = Recipe.objects.annotate(
-                is_favorited=Exists(
-                    Favorite.objects.filter(
-                        user=self.request.user,
-                        recipe__pk=OuterRef('pk')
-                    )
-                ),
-                is_in_shopping_cart=Exists(
-                    Cart.objects.filter(
-                        user=self.request.user,
-                        recipe__pk=OuterRef('pk')
-                    )
-                )
-            )
-        else:
-            queryset = Recipe.objects.all()
-        return queryset
+        # Персональные признаки накладывает RecipeCacheMixin.
+        authors = User.objects.annotate(
+            is_subscribed=Value(False, output_field=BooleanField())
+        )
+        return Recipe.objects.prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -121,36 +186,155 @@ class RecipeViewSet(ModelViewSet):
         kwargs['partial'] = False
         return self.update(request, *args, **kwargs)
 
-    def _recipe_processing(self, request, model, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        favorite_object = model.objects.filter(user=request.user,
-                                               recipe=recipe)
+    def _user_list_changed(self, model, recipe_ids):
+        user_id = self.request.user.pk
+        bump_recipe_versions(recipe_ids)
+        invalidate_personal_sets(user_id)
+        if model is Cart:
+            invalidate_shopping_lists([user_id])
+
+    @transaction.atomic
+    def _recipe_processing(self, request, model, counter, pk):
+        if not str(pk).isdigit():
+            raise Http404
+        recipe_ids = [int(pk)]
         if request.method == 'POST':
-            if favorite_object.exists():
+            recipes = add_recipes_to_list(model, counter, request.user.pk,
+                                          recipe_ids)
+            if not recipes:
+                get_object_or_404(Recipe.objects.only('id'), pk=pk)
                 raise serializers.ValidationError(
                     {'errors': 'Рецепт уже добавлен.'}
                 )
-            model.objects.create(user=request.user, recipe=recipe)
-            return Response(self.get_serializer(recipe).data,
+            self._user_list_changed(model, recipe_ids)
+            return Response(self.get_serializer(recipes[0]).data,
                             status=status.HTTP_201_CREATED)
 
-        if not favorite_object.exists():
+        if not remove_recipes_from_list(model, counter, request.user.pk,
+                                        recipe_ids):
+            get_object_or_404(Recipe.objects.only('id'), pk=pk)
             raise serializers.ValidationError(
                 {'errors': "Данный рецепт не добавлен."}
             )
-        favorite_object.delete()
+        self._user_list_changed(model, recipe_ids)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @transaction.atomic
+    def _batch_processing(self, request, model, counter):
+        batch = RecipeBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(batch.validated_data['recipes']))
+        if request.method == 'POST':
+            recipes = add_recipes_to_list(model, counter, request.user.pk,
+                                          recipe_ids)
+            changed = [recipe.pk for recipe in recipes]
+            data = {'added': RecipeShortInfoSerializer(
+                recipes, many=True, context=self.get_serializer_context()
+            ).data}
+        else:
+            changed = remove_recipes_from_list(model, counter,
+                                               request.user.pk, recipe_ids)
+            data = {'removed': changed}
+        data['skipped'] = [
+            recipe_id for recipe_id in recipe_ids
+            if recipe_id not in set(changed)
+        ]
+        if not changed:
+            return Response(data)
+        self._user_list_changed(model, changed)
+        if request.method == 'POST':
+            return Response(data, status=status.HTTP_201_CREATED)
+        return Response(data)
+
     @action(methods=['post', 'delete'], detail=True)
     def favorite(self, request, *args, **kwargs):
-        return self._recipe_processing(request, Favorite, kwargs['pk'])
+        return self._recipe_processing(
+            request, Favorite, 'favorites_count', kwargs['pk']
+        )
+
+    @action(methods=['post', 'delete'], detail=False, url_path='favorite',
+            permission_classes=[permissions.IsAuthenticated])
+    def favorite_batch(self, request):
+        return self._batch_processing(request, Favorite, 'favorites_count')
 
     @action(methods=['post', 'delete'], detail=True)
     def shopping_cart(self, request, *args, **kwargs):
-        return self._recipe_processing(request, Cart, kwargs['pk'])
+        return self._recipe_processing(
+            request, Cart, 'in_carts_count', kwargs['pk']
+        )
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='shopping_cart',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return self._batch_processing(request, Cart, 'in_carts_count')
 
     @action(detail=False, permission_classes=[permissions.IsAuthenticated])
     def download_shopping_cart(self, request):
-        if not request.user.cart.exists():
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            raise serializers.ValidationError(
+                {'errors': 'Неизвестный формат файла.'}
+            )
+        ingredients = get_shopping_list(request.user)
+        if not ingredients:
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        return download_shopping_list(request)
+        return download_shopping_list(ingredients, file_format)
+
+    @action(detail=False, permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request):
+        paginator = FeedCursorPagination()
+        recipe_ids = paginator.paginate_feed(
+            lambda before, limit: get_feed(request.user.pk, before, limit),
+            request
+        )
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = RecipeSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True, context=self.get_serializer_context()
+        )
+        response = paginator.get_paginated_response(serializer.data)
+        overlay_personal_data(response.data, request.user)
+        return response
+
+    @action(detail=False)
+    def coverage(self, request):
+        params = request.query_params
+        query = CoverageQuerySerializer(data={
+            'ingredients': [
+                value for values in params.getlist('ingredients')
+                for value in values.split(',') if value
+            ],
+            **{
+                name: params[name] for name in ('max_missing', 'limit')
+                if params.get(name)
+            },
+        })
+        query.is_valid(raise_exception=True)
+        fridge = set(query.validated_data['ingredients'])
+        found = coverage_index.search(
+            fridge, query.validated_data.get('max_missing'),
+            query.validated_data['limit']
+        )
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _, _ in found]
+        )
+        missing_ingredients = defaultdict(list)
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+            recipe_id__in=recipes
+        ).exclude(ingredient_id__in=fridge).select_related('ingredient'):
+            missing_ingredients[recipe_ingredient.recipe_id].append(
+                recipe_ingredient.ingredient
+            )
+        results = []
+        for recipe_id, matched, missing in found:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.matched = matched
+            recipe.missing = missing
+            recipe.missing_ingredients = missing_ingredients[recipe_id]
+            results.append(recipe)
+        return Response(RecipeCoverageSerializer(
+            results, many=True, context=self.get_serializer_context()
+        ).data)
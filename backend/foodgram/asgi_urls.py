@@ -0,0 +1,29 @@
+from django.urls import path
+
+from api.async_views import async_view
+from api.views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+from .urls import urlpatterns as sync_urlpatterns
+
+LIST = {'get': 'list', 'post': 'create'}
+DETAIL = {'get': 'retrieve', 'patch': 'partial_update', 'delete': 'destroy'}
+READ_LIST = {'get': 'list'}
+READ_DETAIL = {'get': 'retrieve'}
+
+# Маршруты чтения с асинхронным мостом перекрывают те же адреса из
+# foodgram.urls, всё остальное обслуживается синхронными представлениями.
+urlpatterns = [
+    path('api/recipes/', async_view(RecipeViewSet, LIST),
+         name='async-recipes-list'),
+    path('api/recipes/<int:pk>/', async_view(RecipeViewSet, DETAIL),
+         name='async-recipes-detail'),
+    path('api/tags/', async_view(TagViewSet, READ_LIST),
+         name='async-tags-list'),
+    path('api/tags/<int:pk>/', async_view(TagViewSet, READ_DETAIL),
+         name='async-tags-detail'),
+    path('api/ingredients/', async_view(IngredientViewSet, READ_LIST),
+         name='async-ingredients-list'),
+    path('api/ingredients/<int:pk>/',
+         async_view(IngredientViewSet, READ_DETAIL),
+         name='async-ingredients-detail'),
+] + sync_urlpatterns
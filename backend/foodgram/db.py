@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_KEY = 'db:primary:{}'
+
+# Реплика, выбранная для чтения в текущем запросе; None — читать с основной
+# базы. ContextVar, а не threading.local, чтобы значение доходило до пула
+# потоков асинхронных представлений (api.async_views).
+_read_alias = ContextVar('read_alias', default=None)
+
+
+@contextmanager
+def use_primary():
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+# Аналог CONN_HEALTH_CHECKS из Django 4.1: постоянное соединение, которое
+# могло оборваться между запросами, проверяется перед повторным
+# использованием, а не падает на первом запросе к базе.
+def check_connections():
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if (connection.connection is not None
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
+
+
+def get_client_key(request):
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    return PRIMARY_KEY.format(hashlib.sha256(credentials.encode()).hexdigest())
+
+
+# Безопасные запросы читают с реплики из DATABASE_REPLICAS. Запрос, который
+# пишет, и все запросы того же клиента (заголовок Authorization или cookie
+# сессии) в течение PRIMARY_STICKY_SECONDS после него идут на основную базу,
+# чтобы клиент видел свои изменения независимо от отставания реплик.
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _read_alias.set(self.choose_alias(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = _read_alias.set(self.choose_alias(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.finish(request, response)
+
+    def choose_alias(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        request._client_key = get_client_key(request)
+        if request.method not in SAFE_METHODS or (
+            request._client_key is not None
+            and cache.get(request._client_key)
+        ):
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def finish(self, request, response):
+        if (settings.DATABASE_REPLICAS
+                and request.method not in SAFE_METHODS
+                and request._client_key is not None):
+            cache.set(request._client_key, True,
+                      settings.PRIMARY_STICKY_SECONDS)
+        return response
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -4,13 +4,9 @@ from .models import Cart, Favorite, Ingredient, Recipe, Tag
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
     list_filter = ('author', 'name', 'tags')
-    readonly_fields = ('favorite_count',)
-
-    @staticmethod
-    def favorite_count(obj):
-        return obj.favorites.count()
+    readonly_fields = ('favorites_count', 'in_carts_count')
 
 
 class IngredientAdmin(admin.ModelAdmin):
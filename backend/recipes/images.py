@@ -0,0 +1,116 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+from PIL import Image, ImageOps
+
+from api.recipe_cache import bump_recipe_versions
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipe_pic/variants'
+
+# Название копии: (максимальный размер, обрезать ли точно под размер).
+VARIANTS = {
+    'card': ((600, 600), False),
+    'detail': ((1200, 1200), False),
+    'share': ((1200, 630), True),
+}
+
+FORMATS = (
+    ('', 'JPEG', 'jpg'),
+    ('_webp', 'WEBP', 'webp'),
+)
+
+_executor = None
+
+
+def resize(image, size, crop):
+    if crop:
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    resized = image.copy()
+    resized.thumbnail(size, Image.LANCZOS)
+    return resized
+
+
+def process_recipe_image(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'id', 'image', 'image_variants'
+    ).first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = {'source': source}
+    with recipe.image.open('rb') as f, Image.open(f) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for name, (size, crop) in VARIANTS.items():
+            resized = resize(image, size, crop)
+            for suffix, image_format, ext in FORMATS:
+                buffer = BytesIO()
+                resized.save(buffer, image_format,
+                             quality=settings.RECIPE_IMAGE_QUALITY)
+                variants[name + suffix] = default_storage.save(
+                    f'{VARIANTS_DIR}/{stem}_{name}.{ext}',
+                    ContentFile(buffer.getvalue())
+                )
+    updated = Recipe.objects.filter(pk=recipe_id, image=source).update(
+        image_variants=variants
+    )
+    if updated:
+        bump_recipe_versions([recipe_id])
+    stale = variants.values() if not updated else (
+        set(recipe.image_variants.values()) - set(variants.values())
+    )
+    for name in stale:
+        if name != source and name.startswith(VARIANTS_DIR):
+            default_storage.delete(name)
+
+
+# Рецепты, копии которых не построены или построены для прежнего
+# изображения: созданные до появления копий или потерявшие задачу при
+# перезапуске процесса либо из-за ошибки обработки.
+def get_stale_recipes():
+    return Recipe.objects.exclude(image='').annotate(
+        variants_source=KeyTextTransform('source', 'image_variants')
+    ).filter(
+        Q(variants_source__isnull=True) | ~Q(variants_source=F('image'))
+    )
+
+
+def run_job(recipe_id):
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PIPELINE_WORKERS,
+            thread_name_prefix='recipe-images'
+        )
+    return _executor
+
+
+def schedule_recipe_image(recipe_id):
+    if settings.IMAGE_PIPELINE_SYNC:
+        transaction.on_commit(lambda: process_recipe_image(recipe_id))
+    else:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_job, recipe_id)
+        )
@@ -0,0 +1,381 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from base64 import b64encode
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.error import HTTPError
+from urllib.parse import quote, urlencode
+from urllib.request import Request, urlopen
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from django.test.runner import DiscoverRunner
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.authentication import (CachedJWTAuthentication,
+                                CachedTokenAuthentication)
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.seeding import seed
+from users.models import User
+
+
+# Команда запуска сервера: синхронные воркеры gunicorn или ASGI-воркеры
+# uvicorn с асинхронными маршрутами чтения (foodgram.asgi_urls).
+SERVERS = {
+    'gunicorn': ('foodgram.wsgi',),
+    'uvicorn': ('-k', 'uvicorn.workers.UvicornWorker',
+                'foodgram.asgi:application'),
+}
+
+# Классы аутентификации для замера накладных расходов и схема заголовка.
+AUTHENTICATORS = {
+    'token': (TokenAuthentication, 'Token'),
+    'cached_token': (CachedTokenAuthentication, 'Token'),
+    'cached_jwt': (CachedJWTAuthentication, 'Bearer'),
+}
+
+# Эндпоинт с cached=False замеряется без общего кеша рецептов: в процессе
+# команды кеш очищается перед каждым запросом, а для замеров через сервер
+# запускается отдельный сервер с DummyCache вместо кеша рецептов.
+Endpoint = namedtuple('Endpoint', ('name', 'url', 'auth', 'cached'),
+                      defaults=(True,))
+UNCACHED_RECIPE_CACHE = 'django.core.cache.backends.dummy.DummyCache'
+
+# Смещения для сравнения постраничной пагинации с курсорной. Смещения не
+# меньше числа рецептов пропускаются: для 100k нужен --recipes 100010.
+DEEP_OFFSETS = (0, 10000, 100000)
+DEEP_PAGE_SIZE = 10
+
+
+def encode_cursor(position):
+    return b64encode(urlencode({'p': position}).encode()).decode()
+
+
+# positions: смещение -> id последнего рецепта перед ним (None для нуля).
+def get_deep_endpoints(positions):
+    endpoints = []
+    for offset, position in positions.items():
+        page = offset // DEEP_PAGE_SIZE + 1
+        cursor = (f'&cursor={quote(encode_cursor(position))}'
+                  if position is not None else '')
+        endpoints += [
+            Endpoint(f'recipes_page_{offset}',
+                     f'/api/recipes/?page={page}&limit={DEEP_PAGE_SIZE}',
+                     False, False),
+            Endpoint(f'recipes_cursor_{offset}',
+                     f'/api/recipes/?pagination=cursor'
+                     f'&limit={DEEP_PAGE_SIZE}{cursor}',
+                     False, False),
+        ]
+    return endpoints
+
+
+def get_endpoints(author_id, tag_slug, ingredient, fridge, positions):
+    return [Endpoint(*endpoint) for endpoint in (
+        ('recipes', '/api/recipes/', False),
+        ('users_me', '/api/users/me/', True),
+        ('recipes_auth', '/api/recipes/', True),
+        ('recipes_tags', f'/api/recipes/?tags={tag_slug}', False),
+        ('recipes_author', f'/api/recipes/?author={author_id}', False),
+        ('recipes_favorited', '/api/recipes/?is_favorited=1', True),
+        ('recipes_in_cart', '/api/recipes/?is_in_shopping_cart=1', True),
+        ('recipes_popular', '/api/recipes/?ordering=popular', False),
+        ('recipes_cursor', '/api/recipes/?pagination=cursor', False),
+        ('recipes_search',
+         f'/api/recipes/?search={quote(ingredient)}', False),
+        ('recipes_coverage',
+         f'/api/recipes/coverage/?ingredients={",".join(map(str, fridge))}',
+         False),
+        ('recipes_feed', '/api/recipes/feed/', True),
+        ('subscriptions', '/api/users/subscriptions/?recipes_limit=3', True),
+        ('ingredients_search',
+         f'/api/ingredients/?name={quote(ingredient[:2])}', False),
+        ('download_shopping_cart',
+         '/api/recipes/download_shopping_cart/', True),
+    )] + get_deep_endpoints(positions)
+
+
+def summarize(name, url, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'name': name,
+        'url': url,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'p50_ms': round(percentiles[49] * 1000, 2),
+        'p99_ms': round(percentiles[98] * 1000, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Наполняет тестовую базу синтетическими данными и измеряет '
+            'пропускную способность и задержки ключевых эндпоинтов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=('client',) + tuple(SERVERS),
+                            default='client')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', nargs='*', default=None)
+        parser.add_argument('--auth', choices=('token', 'jwt'),
+                            default='token')
+        parser.add_argument('--output', type=str, default=None)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            results = self.run(options)
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+        report = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report)
+        else:
+            self.stdout.write(report)
+
+    def run(self, options):
+        if options['auth'] == 'jwt' and not settings.JWT_AUTHENTICATION:
+            raise CommandError('Для --auth jwt включите JWT_AUTHENTICATION.')
+        started = time.monotonic()
+        seed(users=options['users'], recipes=options['recipes'],
+             random_seed=options['seed'])
+        seed_seconds = time.monotonic() - started
+        user = User.objects.filter(follower__isnull=False,
+                                   cart__isnull=False).first()
+        credentials = {
+            'Token': Token.objects.get_or_create(user=user)[0].key,
+            'Bearer': str(AccessToken.for_user(user)),
+        }
+        if options['auth'] == 'jwt':
+            authorization = f'Bearer {credentials["Bearer"]}'
+        else:
+            authorization = f'Token {credentials["Token"]}'
+        endpoints = get_endpoints(
+            Recipe.objects.values_list('author_id', flat=True).first(),
+            Tag.objects.values_list('slug', flat=True).first(),
+            Ingredient.objects.values_list('name', flat=True).first(),
+            RecipeIngredient.objects.values_list(
+                'ingredient_id', flat=True
+            ).order_by('-id')[:10],
+            self.get_deep_positions(),
+        )
+        if options['only']:
+            endpoints = [
+                endpoint for endpoint in endpoints
+                if endpoint[0] in options['only']
+            ]
+        if options['target'] in SERVERS:
+            measure = self.measure_server
+        else:
+            measure = self.measure_client
+        return {
+            'meta': {
+                'commit': self.get_commit(),
+                'date': datetime.now(timezone.utc).isoformat(),
+                'target': options['target'],
+                'auth': options['auth'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'users': options['users'],
+                'recipes': options['recipes'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'seed_seconds': round(seed_seconds, 2),
+            },
+            'results': measure(endpoints, authorization, options),
+            'auth': self.measure_auth(credentials, options),
+        }
+
+    @staticmethod
+    def get_deep_positions():
+        total = Recipe.objects.count()
+        ids = Recipe.objects.order_by('-id').values_list('id', flat=True)
+        return {
+            offset: ids[offset - 1] if offset else None
+            for offset in DEEP_OFFSETS if offset < total
+        }
+
+    @staticmethod
+    def clear_caches():
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    @staticmethod
+    def clear_recipe_cache(endpoint):
+        if not endpoint.cached:
+            caches[settings.RECIPE_CACHE_ALIAS].clear()
+
+    def measure_auth(self, credentials, options):
+        results = []
+        for name, (authenticator_class, keyword) in AUTHENTICATORS.items():
+            authenticator = authenticator_class()
+            request = RequestFactory().get(
+                '/', HTTP_AUTHORIZATION=f'{keyword} {credentials[keyword]}'
+            )
+            self.clear_caches()
+            for _ in range(options['warmup']):
+                authenticator.authenticate(request)
+            latencies = []
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    authenticator.authenticate(request)
+                    latencies.append(time.perf_counter() - started)
+            results.append({
+                'name': name,
+                'requests': len(latencies),
+                'mean_us': round(statistics.mean(latencies) * 10 ** 6, 1),
+                'p99_us': round(statistics.quantiles(
+                    latencies, n=100, method='inclusive'
+                )[98] * 10 ** 6, 1),
+                'queries_per_request': round(
+                    len(queries) / len(latencies), 2
+                ),
+            })
+        return results
+
+    def measure_client(self, endpoints, authorization, options):
+        results = []
+        for endpoint in endpoints:
+            name, url, auth, _ = endpoint
+            client = Client()
+            headers = {'HTTP_AUTHORIZATION': authorization} if auth else {}
+            self.clear_caches()
+            for _ in range(options['warmup']):
+                client.get(url, **headers)
+            latencies = []
+            errors = 0
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                self.clear_recipe_cache(endpoint)
+                request_started = time.perf_counter()
+                response = client.get(url, **headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append(time.perf_counter() - request_started)
+                errors += response.status_code >= 400
+            elapsed = time.perf_counter() - started
+            results.append(summarize(name, url, latencies, errors, elapsed))
+        return results
+
+    def measure_server(self, endpoints, authorization, options):
+        if connection.vendor == 'sqlite':
+            raise CommandError(
+                f'Для --target {options["target"]} нужна база, доступная '
+                f'другим процессам (PostgreSQL).'
+            )
+        results = {}
+        for cached in (True, False):
+            group = [
+                endpoint for endpoint in endpoints
+                if endpoint.cached == cached
+            ]
+            if not group:
+                continue
+            env = {} if cached else {
+                'RECIPE_CACHE_BACKEND': UNCACHED_RECIPE_CACHE
+            }
+            with self.start_server(options, env) as base_url:
+                for endpoint in group:
+                    results[endpoint.name] = self.measure_http(
+                        base_url, endpoint, authorization, options
+                    )
+        return [results[endpoint.name] for endpoint in endpoints]
+
+    @contextmanager
+    def start_server(self, options, env):
+        address = f'127.0.0.1:{options["port"]}'
+        server = subprocess.Popen(
+            (sys.executable, '-m', 'gunicorn', '--bind', address,
+             '--workers', str(options['workers']))
+            + SERVERS[options['target']],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ, POSTGRES_DB=connection.settings_dict['NAME'],
+                     **env),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.wait_for(f'http://{address}/api/tags/')
+            yield f'http://{address}'
+        finally:
+            server.terminate()
+            server.wait()
+
+    @staticmethod
+    def wait_for(url, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                urlopen(url, timeout=1).read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Сервер не ответил на {url}')
+
+    def measure_http(self, base_url, endpoint, authorization, options):
+        name, url, auth, _ = endpoint
+        headers = {'Authorization': authorization} if auth else {}
+
+        def fetch(_):
+            started = time.perf_counter()
+            try:
+                with urlopen(Request(base_url + url, headers=headers)) as r:
+                    r.read()
+                failed = False
+            except HTTPError:
+                failed = True
+            return time.perf_counter() - started, failed
+
+        # Кеш серверных процессов очищается отсюда, только если он общий
+        # (CACHE_BACKEND/RECIPE_CACHE_BACKEND вне процесса).
+        self.clear_caches()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            list(pool.map(fetch, range(options['warmup'])))
+            started = time.perf_counter()
+            samples = list(pool.map(fetch, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        return summarize(
+            name, url, [latency for latency, _ in samples],
+            sum(failed for _, failed in samples), elapsed
+        )
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(
+                ('git', 'rev-parse', '--short', 'HEAD'),
+                capture_output=True, text=True, cwd=settings.BASE_DIR,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
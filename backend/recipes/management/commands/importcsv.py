@@ -1,15 +1,86 @@
 import csv
+import json
 import os
+import re
+import time
+from itertools import islice
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.catalog import bump_catalog_version
 from recipes.models import Ingredient, Tag
 
 DATA_ROOT = os.path.join(settings.BASE_DIR, 'recipes/data')
 
+# Модель, поля файла и поля, по которым запись считается уже загруженной.
+CATALOGS = {
+    Ingredient: (('name', 'measurement_unit'), ('name', 'measurement_unit')),
+    Tag: (('name', 'color', 'slug'), ('slug',)),
+}
+
+JSON_CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+
+
+# Массив JSON читается блоками по JSON_CHUNK_SIZE, и элементы разбираются по
+# одному, так что в памяти не бывает больше блока и одного элемента.
+def read_json_array(f, path):
+    decoder = json.JSONDecoder()
+    buffer, position, state = '', 0, 'start'
+    while True:
+        chunk = f.read(JSON_CHUNK_SIZE)
+        buffer, position = buffer[position:] + chunk, 0
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            char = buffer[position]
+            if state == 'start':
+                if char != '[':
+                    raise CommandError(f'{path}: ожидается массив JSON')
+                position += 1
+                state = 'first'
+            elif char == ']' and state in ('first', 'separator'):
+                return
+            elif state == 'separator':
+                if char != ',':
+                    raise CommandError(f'{path}: неверный JSON')
+                position += 1
+                state = 'item'
+            else:
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise CommandError(f'{path}: неверный JSON')
+                    break
+                yield item
+                state = 'separator'
+        if not chunk:
+            raise CommandError(f'{path}: неожиданный конец JSON')
+
+
+def read_rows(path, fields):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            items = (json.loads(line) for line in f if line.strip())
+        elif path.endswith('.json'):
+            items = read_json_array(f, path)
+        else:
+            for row in csv.reader(f):
+                if len(row) != len(fields):
+                    raise CommandError(f'{path}: неверная строка {row}')
+                yield tuple(value.strip() for value in row)
+            return
+        for item in items:
+            yield tuple(str(item[field]).strip() for field in fields)
+
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты и теги из CSV, JSON или JSON Lines.'
+
     def add_arguments(self, parser):
         parser.add_argument(
             'filename',
@@ -17,33 +88,63 @@ class Command(BaseCommand):
             nargs='?',
             type=str
         )
+        parser.add_argument('--tags', default='tags.csv', type=str)
+        parser.add_argument('--no-tags', action='store_true')
+        parser.add_argument('--batch-size', default=1000, type=int)
+        parser.add_argument('--dry-run', action='store_true')
 
     def handle(self, *args, **options):
-        try:
-            with open(os.path.join(DATA_ROOT, options['filename']),
-                      'r', encoding='utf-8') as f:
-                data = csv.reader(f)
-                for row in data:
-                    name, measurement_unit = row
-                    Ingredient.objects.get_or_create(
-                        name=name,
-                        measurement_unit=measurement_unit
-                    )
-                print('Load ingredients.csv have successful finished')
-        except FileNotFoundError:
-            raise CommandError('recipes/data/ingredients.csv is not exist')
+        files = [(Ingredient, options['filename'], 'ingredients')]
+        if not options['no_tags']:
+            files.append((Tag, options['tags'], 'tags'))
+        with transaction.atomic():
+            for model, filename, catalog in files:
+                self.load(model, os.path.join(DATA_ROOT, filename),
+                          options['batch_size'])
+            if options['dry_run']:
+                transaction.set_rollback(True)
+                self.stdout.write('Dry run: изменения не сохранены')
+        if not options['dry_run']:
+            for model, filename, catalog in files:
+                bump_catalog_version(catalog)
 
+    def load(self, model, path, batch_size):
+        fields, key_fields = CATALOGS[model]
+        key_indexes = [fields.index(field) for field in key_fields]
+        seen = set()
+        total = 0
+        before = model.objects.count()
+        started = time.monotonic()
         try:
-            with open(os.path.join(DATA_ROOT, 'tags.csv'),
-                      'r', encoding='utf-8') as f:
-                data = csv.reader(f)
-                for row in data:
-                    name, color, slug = row
-                    Tag.objects.get_or_create(
-                        name=name,
-                        color=color,
-                        slug=slug
-                    )
-                print('Load tags.csv have successful finished')
+            rows = read_rows(path, fields)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                total += len(batch)
+                new = {}
+                for row in batch:
+                    key = tuple(row[index] for index in key_indexes)
+                    if key not in seen:
+                        seen.add(key)
+                        new[key] = row
+                existing = set(model.objects.filter(**{
+                    f'{key_fields[0]}__in': {key[0] for key in new}
+                }).values_list(*key_fields))
+                objects = [
+                    model(**dict(zip(fields, row)))
+                    for key, row in new.items() if key not in existing
+                ]
+                model.objects.bulk_create(
+                    objects, batch_size=batch_size, ignore_conflicts=True
+                )
         except FileNotFoundError:
-            raise CommandError('recipes/data/tags.csv is not exist')
+            raise CommandError(f'{path} is not exist')
+        elapsed = time.monotonic() - started
+        # ignore_conflicts пропускает строки молча, поэтому добавленные
+        # считаются по таблице, а не по переданным в bulk_create.
+        created = model.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'{os.path.basename(path)}: прочитано {total}, '
+            f'добавлено {created}, {total / max(elapsed, 1e-6):.0f} строк/с'
+        ))
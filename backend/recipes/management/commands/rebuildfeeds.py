@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.feed import rebuild_feeds
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = ('Заполняет ленты подписок последними рецептами авторов, '
+            'на которых подписаны пользователи.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_feeds()
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {FeedEntry.objects.count()}'
+        ))
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.images import get_stale_recipes, run_job
+
+
+class Command(BaseCommand):
+    help = ('Строит уменьшенные копии изображений рецептов, у которых их '
+            'нет или они построены для прежнего изображения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.IMAGE_PIPELINE_WORKERS)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        recipe_ids = list(get_stale_recipes().values_list('id', flat=True))
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Рецептов без актуальных копий: {len(recipe_ids)} (dry run)'
+            ))
+            return
+        with ThreadPoolExecutor(max(options['workers'], 1)) as pool:
+            list(pool.map(run_job, recipe_ids))
+        failed = get_stale_recipes().filter(id__in=recipe_ids).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {len(recipe_ids) - failed}, '
+            f'с ошибкой: {failed}'
+        ))
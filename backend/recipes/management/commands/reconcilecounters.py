@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Cart, Favorite, Recipe
+
+COUNTERS = {
+    'favorites_count': Favorite,
+    'in_carts_count': Cart,
+}
+
+
+def count_rows(model):
+    return Coalesce(Subquery(
+        model.objects.filter(recipe=OuterRef('pk')).order_by().values(
+            'recipe'
+        ).annotate(total=Count('id')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного и списков покупок '
+            'у рецептов и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = Recipe.objects.select_for_update().annotate(**{
+                f'actual_{counter}': count_rows(model)
+                for counter, model in COUNTERS.items()
+            }).filter(Q(*(
+                ~Q(**{counter: F(f'actual_{counter}')})
+                for counter in COUNTERS
+            ), _connector=Q.OR))
+            ids = list(drifted.values_list('id', flat=True))
+            if ids and not options['dry_run']:
+                Recipe.objects.filter(id__in=ids).update(**{
+                    counter: count_rows(model)
+                    for counter, model in COUNTERS.items()
+                })
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов с расхождением счётчиков: {len(ids)}'
+            + (' (dry run)' if options['dry_run'] else '')
+        ))
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.seeding import BATCH_SIZE, CHUNK_SIZE, seed
+
+
+class Command(BaseCommand):
+    help = ('Наполняет базу синтетическими пользователями, рецептами, '
+            'избранным, списками покупок и подписками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число избранных на пользователя')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Среднее число рецептов в списке покупок')
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Среднее число подписок на пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 рецепт.')
+        if min(options['batch_size'], options['chunk_size'],
+               options['workers']) < 1:
+            raise CommandError('Размеры пакета, блока и число процессов '
+                               'должны быть положительными.')
+        started = time.monotonic()
+        user_ids, recipe_ids = seed(
+            users=options['users'],
+            recipes=options['recipes'],
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            favorites=options['favorites'],
+            carts=options['carts'],
+            follows=options['follows'],
+            random_seed=options['seed'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            chunk_size=options['chunk_size'],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, рецептов: '
+            f'{len(recipe_ids)} за {time.monotonic() - started:.1f} s'
+        ))
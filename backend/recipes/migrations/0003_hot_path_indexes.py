@@ -0,0 +1,101 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:25
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+MAX_AMOUNT = 30000
+
+
+# Админка и прежний importcsv могли создать одинаковые ингредиенты. Перед
+# добавлением unique_ingredient строки рецептов переносятся на дубликат с
+# наименьшим id, остальные удаляются, а совпавшие после переноса строки
+# одного рецепта объединяются с суммой количества.
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    db = schema_editor.connection.alias
+    if schema_editor.connection.vendor == 'postgresql':
+        # Иначе отложенные проверки внешних ключей не дадут изменить таблицу
+        # ингредиентов в той же транзакции.
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    duplicates = Ingredient.objects.using(db).values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), total=Count('id')).filter(
+        total__gt=1
+    ).order_by()
+    kept = []
+    for duplicate in duplicates:
+        extra = Ingredient.objects.using(db).filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit']
+        ).exclude(id=duplicate['keep'])
+        RecipeIngredient.objects.using(db).filter(
+            ingredient__in=extra
+        ).update(ingredient_id=duplicate['keep'])
+        extra.delete()
+        kept.append(duplicate['keep'])
+    rows = RecipeIngredient.objects.using(db).filter(
+        ingredient_id__in=kept
+    ).values('recipe_id', 'ingredient_id').annotate(
+        keep=Min('id'), amount=Sum('amount'), total=Count('id')
+    ).filter(total__gt=1).order_by()
+    for row in rows:
+        RecipeIngredient.objects.using(db).filter(
+            recipe_id=row['recipe_id'], ingredient_id=row['ingredient_id']
+        ).exclude(id=row['keep']).delete()
+        RecipeIngredient.objects.using(db).filter(id=row['keep']).update(
+            amount=min(row['amount'], MAX_AMOUNT)
+        )
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS ingredient_name_trgm_idx '
+            'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='amount',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Нельзя создать рецепт без ингредиентов'), django.core.validators.MaxValueValidator(30000, message='Вес ингридиента не может быть больше 30кг!')], verbose_name='Количество'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['recipe', 'user'], name='cart_recipe_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['recipe', 'user'], name='favorite_recipe_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['name'], name='ingredient_name_pattern_idx', opclasses=('varchar_pattern_ops',)),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-id'], name='recipe_author_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
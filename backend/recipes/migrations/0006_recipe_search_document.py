@@ -0,0 +1,71 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:42
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+DOCUMENT_SOURCE = '''
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_recipeingredient recipe_ingredient
+        ON recipe_ingredient.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = recipe_ingredient.ingredient_id
+    GROUP BY recipe.id
+'''
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+            'ON recipes_recipesearchdocument USING gin (vector)'
+        )
+        schema_editor.execute(
+            "INSERT INTO recipes_recipesearchdocument (recipe_id, vector) "
+            "SELECT recipe.id, "
+            "setweight(to_tsvector('russian', recipe.name), 'A') "
+            "|| setweight(to_tsvector('russian', "
+            "coalesce(string_agg(ingredient.name, ' '), '')), 'B') "
+            "|| setweight(to_tsvector('russian', recipe.text), 'C')"
+            + DOCUMENT_SOURCE
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts USING '
+            'fts5(name, ingredients, text, '
+            'tokenize="unicode61 remove_diacritics 2")'
+        )
+        schema_editor.execute(
+            'INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text) '
+            'SELECT recipe.id, recipe.name, '
+            "coalesce(group_concat(ingredient.name, ' '), ''), recipe.text"
+            + DOCUMENT_SOURCE
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_popularity_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSearchDocument',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('vector', django.contrib.postgres.search.SearchVectorField(verbose_name='Поисковый вектор')),
+            ],
+            options={
+                'verbose_name': 'Поисковый документ рецепта',
+                'verbose_name_plural': 'Поисковые документы рецептов',
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,115 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Value
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# Веса столбцов FTS5 в том же порядке, что и в таблице: название,
+# ингредиенты, описание.
+FTS_WEIGHTS = '10.0, 4.0, 1.0'
+BATCH_SIZE = 500
+
+POSTGRES_DOCUMENTS = f'''
+    INSERT INTO recipes_recipesearchdocument (recipe_id, vector)
+    SELECT recipe.id,
+        setweight(to_tsvector('{SEARCH_CONFIG}', recipe.name), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}',
+                                 coalesce(string_agg(ingredient.name, ' '),
+                                          '')), 'B')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', recipe.text), 'C')
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_recipeingredient recipe_ingredient
+        ON recipe_ingredient.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = recipe_ingredient.ingredient_id
+    WHERE recipe.id {{condition}}
+    GROUP BY recipe.id
+    ON CONFLICT (recipe_id) DO UPDATE SET vector = EXCLUDED.vector
+'''
+
+SQLITE_DOCUMENTS = f'''
+    INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text)
+    SELECT recipe.id, recipe.name,
+        coalesce(group_concat(ingredient.name, ' '), ''), recipe.text
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_recipeingredient recipe_ingredient
+        ON recipe_ingredient.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = recipe_ingredient.ingredient_id
+    WHERE recipe.id {{condition}}
+    GROUP BY recipe.id
+'''
+
+WORD = re.compile(r'\w+')
+# Окончания для упрощённого стемминга запроса на SQLite, где у FTS5 нет
+# русского стеммера: основа ищется как префикс.
+ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ой', 'ей', 'ий',
+    'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ах',
+    'ях', 'ов', 'ев', 'ию', 'ья', 'ью', 'а', 'я', 'о', 'е', 'ы', 'и', 'у',
+    'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+
+def write_documents(condition, params):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(POSTGRES_DOCUMENTS.format(condition=condition),
+                           params)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid {condition}',
+                           params)
+            cursor.execute(SQLITE_DOCUMENTS.format(condition=condition),
+                           params)
+
+
+def update_search_documents(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        write_documents(
+            'IN ({})'.format(', '.join(['%s'] * len(batch))), batch
+        )
+
+
+def rebuild_search_documents(min_id=0):
+    write_documents('>= %s', [min_id])
+
+
+def delete_search_documents(recipe_ids):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                               [(recipe_id,) for recipe_id in recipe_ids])
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def search_recipes(queryset, query):
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                                   search_type='websearch')
+        return queryset.filter(
+            search_document__vector=search_query
+        ).annotate(search_rank=SearchRank(
+            F('search_document__vector'), search_query
+        ))
+    words = WORD.findall(query.lower())
+    if not words:
+        return queryset.none().annotate(search_rank=Value(0))
+    # Соединение с FTS5 через extra(): таблица не описана моделью, а
+    # коррелированный подзапрос с bm25() выполнял бы MATCH для каждой строки.
+    return queryset.extra(
+        select={'search_rank': f'-bm25({FTS_TABLE}, {FTS_WEIGHTS})'},
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = recipes_recipe.id',
+               f'{FTS_TABLE} MATCH %s'],
+        params=[' '.join(f'"{stem(word)}"*' for word in words)],
+    )
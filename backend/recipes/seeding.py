@@ -0,0 +1,280 @@
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+
+from api.coverage_index import reset_coverage_index
+from api.feed import rebuild_feeds
+from api.recipe_cache import bump_generation
+from users.models import Follow, User
+
+from .management.commands.reconcilecounters import COUNTERS, count_rows
+from .models import Cart, Favorite, Ingredient, Recipe, RecipeIngredient, Tag
+from .search import rebuild_search_documents
+
+BATCH_SIZE = 5000
+CHUNK_SIZE = 10000
+# Показатели степенных распределений: популярность авторов, рецептов и
+# ингредиентов (закон Ципфа) и активность пользователей (Парето).
+ZIPF_EXPONENT = 1.1
+PARETO_ALPHA = 1.5
+
+_seeder = None
+
+
+def zipf_cum_weights(size, exponent=ZIPF_EXPONENT):
+    return list(accumulate(
+        1 / rank ** exponent for rank in range(1, size + 1)
+    ))
+
+
+def heavy_tailed(rng, mean, limit):
+    scale = mean * (PARETO_ALPHA - 1) / PARETO_ALPHA
+    return min(int(rng.paretovariate(PARETO_ALPHA) * scale), limit)
+
+
+def weighted_sample(rng, population, cum_weights, size, exclude=None):
+    picked = set()
+    for _ in range(10):
+        missing = size - len(picked)
+        if missing <= 0:
+            break
+        picked.update(rng.choices(population, cum_weights=cum_weights,
+                                  k=missing))
+        picked.discard(exclude)
+    return list(islice(picked, size))
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_objects(model, objs):
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key or objs[0].pk is not None
+    ]
+    buffer = StringIO()
+    for obj in objs:
+        buffer.write('\t'.join(
+            copy_value(field.get_db_prep_save(
+                field.pre_save(obj, True), connection
+            ))
+            for field in fields
+        ) + '\n')
+    buffer.seek(0)
+    columns = ', '.join(connection.ops.quote_name(field.column)
+                        for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {connection.ops.quote_name(model._meta.db_table)} '
+            f'({columns}) FROM STDIN',
+            buffer
+        )
+
+
+def write_objects(model, objs, batch_size=BATCH_SIZE):
+    objs = iter(objs)
+    while True:
+        batch = list(islice(objs, batch_size))
+        if not batch:
+            return
+        if connection.vendor == 'postgresql':
+            copy_objects(model, batch)
+        else:
+            model.objects.bulk_create(batch)
+
+
+def run_chunk(method, chunk):
+    try:
+        with transaction.atomic():
+            getattr(_seeder, method)(chunk)
+    finally:
+        if multiprocessing.parent_process() is not None:
+            connections.close_all()
+
+
+# Генератор синтетических данных. Идентификаторы пользователей и рецептов
+# назначаются заранее, начиная с текущего максимума, поэтому дочерние записи
+# пишутся без обратного чтения, а данные каждого блока зависят только от seed
+# и номера блока и не меняются от числа процессов. Во время наполнения в базу
+# не должны писать другие клиенты.
+class Seeder:
+    def __init__(self, users, recipes, ingredients_per_recipe, favorites,
+                 carts, follows, random_seed, batch_size, chunk_size):
+        self.users = users
+        self.recipes = recipes
+        self.ingredients_per_recipe = ingredients_per_recipe
+        self.favorites = favorites
+        self.carts = carts
+        self.follows = follows
+        self.random_seed = random_seed
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.prefix = f'seed{random_seed}_'
+
+    def rng(self, *key):
+        return random.Random(':'.join(map(str, (self.random_seed,) + key)))
+
+    def prepare(self):
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            call_command('importcsv', stdout=StringIO())
+        user_base = User.objects.aggregate(last=Max('id'))['last'] or 0
+        recipe_base = Recipe.objects.aggregate(last=Max('id'))['last'] or 0
+        self.user_ids = list(range(user_base + 1,
+                                   user_base + self.users + 1))
+        self.recipe_ids = list(range(recipe_base + 1,
+                                     recipe_base + self.recipes + 1))
+        self.ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.tag_ids = list(
+            Tag.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.password = make_password(None)
+        # Ранг популярности не совпадает с порядком id.
+        self.authors = self.ranked(self.user_ids, 'authors')
+        self.popular_recipes = self.ranked(self.recipe_ids, 'recipes')
+        self.popular_ingredients = self.ranked(self.ingredient_ids,
+                                               'ingredients')
+
+    def ranked(self, ids, name):
+        ids = list(ids)
+        self.rng('rank', name).shuffle(ids)
+        return ids, zipf_cum_weights(len(ids))
+
+    def chunks(self, ids):
+        return [
+            (number, ids[start:start + self.chunk_size])
+            for number, start in enumerate(range(0, len(ids),
+                                                 self.chunk_size))
+        ]
+
+    def seed_users(self, chunk):
+        user_ids = chunk[1]
+        write_objects(User, (
+            User(id=user_id, username=f'{self.prefix}{user_id}',
+                 email=f'{self.prefix}{user_id}@example.com',
+                 first_name='Bench', last_name=str(user_id),
+                 password=self.password)
+            for user_id in user_ids
+        ), self.batch_size)
+
+    def seed_recipes(self, chunk):
+        number, recipe_ids = chunk
+        rng = self.rng('recipes', number)
+        authors, author_weights = self.authors
+        write_objects(Recipe, (
+            Recipe(id=recipe_id, author_id=author_id,
+                   name=f'{self.prefix}рецепт {recipe_id}',
+                   text='Синтетический рецепт для нагрузочного тестирования.',
+                   cooking_time=rng.randint(5, 180),
+                   image='recipe_pic/benchmark.jpg')
+            for recipe_id, author_id in zip(recipe_ids, rng.choices(
+                authors, cum_weights=author_weights, k=len(recipe_ids)
+            ))
+        ), self.batch_size)
+        write_objects(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(self.tag_ids,
+                                     rng.randint(1, min(3, len(self.tag_ids))))
+        ), self.batch_size)
+        ingredients, ingredient_weights = self.popular_ingredients
+        write_objects(RecipeIngredient, (
+            RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=rng.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in weighted_sample(
+                rng, ingredients, ingredient_weights,
+                max(1, heavy_tailed(rng, self.ingredients_per_recipe,
+                                    len(ingredients)))
+            )
+        ), self.batch_size)
+
+    def seed_activity(self, chunk):
+        number, user_ids = chunk
+        rng = self.rng('activity', number)
+        recipes, recipe_weights = self.popular_recipes
+        for model, mean in ((Favorite, self.favorites),
+                            (Cart, self.carts)):
+            write_objects(model, (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in weighted_sample(
+                    rng, recipes, recipe_weights,
+                    heavy_tailed(rng, mean, len(recipes))
+                )
+            ), self.batch_size)
+        authors, author_weights = self.authors
+        write_objects(Follow, (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in weighted_sample(
+                rng, authors, author_weights,
+                heavy_tailed(rng, self.follows, len(authors) - 1),
+                exclude=user_id
+            )
+        ), self.batch_size)
+
+    def run(self, method, ids, workers, stdout):
+        chunks = self.chunks(ids)
+        started = time.monotonic()
+        in_memory = (connection.vendor == 'sqlite'
+                     and connection.is_in_memory_db())
+        if workers <= 1 or len(chunks) <= 1 or in_memory:
+            for chunk in chunks:
+                run_chunk(method, chunk)
+        else:
+            # Дочерние процессы наследуют генератор через fork и открывают
+            # собственные соединения с базой.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('fork')
+            ) as pool:
+                list(pool.map(run_chunk, [method] * len(chunks), chunks))
+        if stdout is not None:
+            stdout.write(f'{method}: {len(ids)} объектов, {len(chunks)} '
+                         f'блоков, {time.monotonic() - started:.1f} s')
+
+    def finish(self):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(),
+                                                         [User, Recipe]):
+                cursor.execute(sql)
+        if not self.recipe_ids:
+            return
+        Recipe.objects.filter(id__gte=self.recipe_ids[0]).update(**{
+            counter: count_rows(model)
+            for counter, model in COUNTERS.items()
+        })
+        rebuild_search_documents(self.recipe_ids[0])
+        rebuild_feeds(self.recipe_ids[0])
+
+
+def seed(users=100, recipes=2000, ingredients_per_recipe=8, favorites=20,
+         carts=5, follows=10, random_seed=0, workers=1, batch_size=BATCH_SIZE,
+         chunk_size=CHUNK_SIZE, stdout=None):
+    global _seeder
+    seeder = _seeder = Seeder(users, recipes, ingredients_per_recipe,
+                              favorites, carts, follows, random_seed,
+                              batch_size, chunk_size)
+    seeder.prepare()
+    seeder.run('seed_users', seeder.user_ids, workers, stdout)
+    seeder.run('seed_recipes', seeder.recipe_ids, workers, stdout)
+    seeder.run('seed_activity', seeder.user_ids, workers, stdout)
+    seeder.finish()
+    bump_generation()
+    reset_coverage_index()
+    return seeder.user_ids, seeder.recipe_ids
@@ -0,0 +1,179 @@
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from PIL import Image, features
+
+from api.filters import RecipeFilter
+from recipes.images import get_stale_recipes, process_recipe_image
+from recipes.management.commands import importcsv
+from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from recipes.seeding import seed
+from users.models import User
+
+
+class ImportCsvTest(TestCase):
+    def write(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def load(self, path):
+        stdout = StringIO()
+        call_command('importcsv', path, no_tags=True, stdout=stdout)
+        return stdout.getvalue()
+
+    @mock.patch.object(importcsv, 'JSON_CHUNK_SIZE', 7)
+    def test_json_array_is_read_in_chunks(self):
+        path = self.write('.json', json.dumps([
+            {'name': f'соль {number}', 'measurement_unit': 'г'}
+            for number in range(20)
+        ], ensure_ascii=False, indent=2))
+        self.load(path)
+        self.assertEqual(Ingredient.objects.count(), 20)
+
+    def test_invalid_json_is_rejected(self):
+        path = self.write('.json', '[{"name": "соль", "measurement_unit"')
+        with self.assertRaises(CommandError):
+            self.load(path)
+
+    def test_reports_inserted_rows(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        path = self.write('.csv', 'соль,г\nсахар,г\nсахар,г\n')
+        output = self.load(path)
+        self.assertIn('прочитано 3, добавлено 1', output)
+        self.assertEqual(self.load(path).count('добавлено 0'), 1)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RebuildImagesTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='cook', email='cook@ya.ru')
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'white').save(buffer, 'PNG')
+        image = default_storage.save('recipe_pic/old.png',
+                                     ContentFile(buffer.getvalue()))
+        cls.old, cls.processed, cls.replaced = (
+            Recipe.objects.create(
+                author=author, name=name, text='Описание', cooking_time=5,
+                image=image, image_variants=variants
+            )
+            for name, variants in (
+                ('Без копий', {}),
+                ('С копиями', {'source': image}),
+                ('Новое фото', {'source': 'recipe_pic/previous.png'}),
+            )
+        )
+        Recipe.objects.create(author=author, name='Без фото', text='Описание',
+                              cooking_time=5, image='')
+
+    def test_stale_recipes(self):
+        self.assertQuerysetEqual(
+            get_stale_recipes().order_by('id'),
+            [self.old, self.replaced]
+        )
+
+    def test_dry_run(self):
+        stdout = StringIO()
+        call_command('rebuildimages', dry_run=True, stdout=stdout)
+        self.assertIn('Рецептов без актуальных копий: 2', stdout.getvalue())
+
+    @skipUnless(features.check('webp'), 'Pillow собран без WebP')
+    def test_processed_recipe_is_no_longer_stale(self):
+        process_recipe_image(self.old.pk)
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.image_variants['source'], self.old.image)
+        self.assertNotIn(self.old, get_stale_recipes())
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+# Планы проверяются на наполненной базе после ANALYZE. Последовательное
+# сканирование запрещено через enable_seqscan, чтобы результат не зависел от
+# объёма тестовых данных: планировщик выберет его, только если подходящего
+# индекса нет.
+@skipUnless(connection.vendor == 'postgresql',
+            'EXPLAIN-проверки рассчитаны на PostgreSQL')
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(users=200, recipes=3000, random_seed=1)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user_id = Favorite.objects.values_list('user_id', flat=True)[0]
+        cls.recipe_id = Favorite.objects.values_list('recipe_id',
+                                                     flat=True)[0]
+        cls.author_id = Recipe.objects.values_list('author_id', flat=True)[0]
+        cls.tags = list(Tag.objects.all()[:2])
+
+    def assertNoSeqScan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            cursor.execute('SET LOCAL enable_seqscan = on')
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = [
+            node.get('Relation Name')
+            for node in plan_nodes(plan[0]['Plan'])
+            if node['Node Type'] == 'Seq Scan'
+        ]
+        self.assertEqual(scans, [], f'Seq Scan в плане запроса: {sql}')
+
+    # Автодополнение ищет по индексу в памяти, а в базе ингредиенты по имени
+    # ищет только importcsv, проверяя уже загруженные строки пакета.
+    def test_ingredient_import_lookup(self):
+        names = list(Ingredient.objects.values_list('name', flat=True)[:100])
+        self.assertNoSeqScan(Ingredient.objects.filter(
+            name__in=names
+        ).values_list('name', 'measurement_unit'))
+
+    def test_recipes_by_author(self):
+        self.assertNoSeqScan(
+            Recipe.objects.filter(author_id=self.author_id)[:6]
+        )
+
+    def test_recipes_by_tags(self):
+        self.assertNoSeqScan(
+            Recipe.objects.filter(RecipeFilter.recipe_has_tags(self.tags))[:6]
+        )
+
+    def test_users_of_recipe(self):
+        for model in (Favorite, Cart):
+            with self.subTest(model=model.__name__):
+                self.assertNoSeqScan(
+                    model.objects.filter(recipe_id=self.recipe_id)
+                )
+
+    def test_recipes_of_user(self):
+        for model in (Favorite, Cart):
+            with self.subTest(model=model.__name__):
+                self.assertNoSeqScan(
+                    model.objects.filter(user_id=self.user_id)
+                )